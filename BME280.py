@@ -5,6 +5,7 @@ https://github.com/DFRobot/micropython-dflib
 """
 
 from machine import I2C
+import struct
 import time
 
 # BME280 default address.
@@ -17,6 +18,28 @@ BME280_OSAMPLE_4 = 3
 BME280_OSAMPLE_8 = 4
 BME280_OSAMPLE_16 = 5
 
+# Power modes
+BME280_SLEEP_MODE = 0
+BME280_FORCED_MODE = 1
+BME280_NORMAL_MODE = 3
+
+# Standby time between conversions in normal mode
+BME280_STANDBY_0_5 = 0  # 0.5 ms
+BME280_STANDBY_62_5 = 1  # 62.5 ms
+BME280_STANDBY_125 = 2  # 125 ms
+BME280_STANDBY_250 = 3  # 250 ms
+BME280_STANDBY_500 = 4  # 500 ms
+BME280_STANDBY_1000 = 5  # 1000 ms
+BME280_STANDBY_10 = 6  # 10 ms
+BME280_STANDBY_20 = 7  # 20 ms
+
+# IIR filter coefficients
+BME280_FILTER_OFF = 0
+BME280_FILTER_2 = 1
+BME280_FILTER_4 = 2
+BME280_FILTER_8 = 3
+BME280_FILTER_16 = 4
+
 # BME280 Registers
 
 BME280_REGISTER_DIG_T1 = 0x88  # Trimming parameter registers
@@ -46,6 +69,7 @@ BME280_REGISTER_VERSION = 0xD1
 BME280_REGISTER_SOFTRESET = 0xE0
 
 BME280_REGISTER_CONTROL_HUM = 0xF2
+BME280_REGISTER_STATUS = 0xF3
 BME280_REGISTER_CONTROL = 0xF4
 BME280_REGISTER_CONFIG = 0xF5
 BME280_REGISTER_PRESSURE_DATA = 0xF7
@@ -84,6 +108,16 @@ class Device:
         b[1] = (value >> 8) & 0xFF
         self.i2c.writeto_mem(self._address, register, value)
 
+    def readList(self, register, length):
+        """Read a length number of bytes from the specified register. Results
+        will be returned as a bytes object."""
+        return self._i2c.readfrom_mem(self._address, register, length)
+
+    def readInto(self, register, buf):
+        """Read len(buf) bytes from the specified register into the given
+        preallocated buffer."""
+        self._i2c.readfrom_mem_into(self._address, register, buf)
+
     def readRaw8(self):
         """Read an 8-bit value on the bus (without register)."""
         return int.from_bytes(self._i2c.readfrom(self._address, 1), "little") & 0xFF
@@ -146,8 +180,29 @@ class Device:
 
 class BME280:
     def __init__(
-        self, mode=BME280_OSAMPLE_1, address=BME280_I2CADDR, i2c=None, **kwargs
+        self,
+        mode=BME280_OSAMPLE_1,
+        address=BME280_I2CADDR,
+        i2c=None,
+        cache_calibration=False,
+        poll_status=False,
+        **kwargs
     ):
+        self._check_oversampling(mode)
+        self._mode = mode
+        self._poll_status = poll_status
+        # Create I2C device.
+        if i2c is None:
+            raise ValueError("An I2C object is required.")
+        self._device = Device(address, i2c)
+        self._data = bytearray(8)
+        # Load calibration values.
+        self._load_calibration(cache_calibration)
+        # Stay in sleep mode until a forced conversion is triggered
+        self.configure()
+        self.t_fine = 0
+
+    def _check_oversampling(self, mode):
         # Check that mode is valid.
         if mode not in [
             BME280_OSAMPLE_1,
@@ -158,59 +213,154 @@ class BME280:
         ]:
             raise ValueError(
                 "Unexpected mode value {0}. Set mode to one of "
-                "BME280_ULTRALOWPOWER, BME280_STANDARD, BME280_HIGHRES, or "
-                "BME280_ULTRAHIGHRES".format(mode)
+                "BME280_OSAMPLE_1, BME280_OSAMPLE_2, BME280_OSAMPLE_4, "
+                "BME280_OSAMPLE_8 or BME280_OSAMPLE_16".format(mode)
             )
-        self._mode = mode
-        # Create I2C device.
-        if i2c is None:
-            raise ValueError("An I2C object is required.")
-        self._device = Device(address, i2c)
-        # Load calibration values.
-        self._load_calibration()
-        self._device.write8(BME280_REGISTER_CONTROL, 0x3F)
-        self.t_fine = 0
-
-    def _load_calibration(self):
-
-        self.dig_T1 = self._device.readU16LE(BME280_REGISTER_DIG_T1)
-        self.dig_T2 = self._device.readS16LE(BME280_REGISTER_DIG_T2)
-        self.dig_T3 = self._device.readS16LE(BME280_REGISTER_DIG_T3)
-
-        self.dig_P1 = self._device.readU16LE(BME280_REGISTER_DIG_P1)
-        self.dig_P2 = self._device.readS16LE(BME280_REGISTER_DIG_P2)
-        self.dig_P3 = self._device.readS16LE(BME280_REGISTER_DIG_P3)
-        self.dig_P4 = self._device.readS16LE(BME280_REGISTER_DIG_P4)
-        self.dig_P5 = self._device.readS16LE(BME280_REGISTER_DIG_P5)
-        self.dig_P6 = self._device.readS16LE(BME280_REGISTER_DIG_P6)
-        self.dig_P7 = self._device.readS16LE(BME280_REGISTER_DIG_P7)
-        self.dig_P8 = self._device.readS16LE(BME280_REGISTER_DIG_P8)
-        self.dig_P9 = self._device.readS16LE(BME280_REGISTER_DIG_P9)
 
-        self.dig_H1 = self._device.readU8(BME280_REGISTER_DIG_H1)
-        self.dig_H2 = self._device.readS16LE(BME280_REGISTER_DIG_H2)
-        self.dig_H3 = self._device.readU8(BME280_REGISTER_DIG_H3)
-        self.dig_H6 = self._device.readS8(BME280_REGISTER_DIG_H7)
+    def configure(
+        self,
+        power_mode=BME280_FORCED_MODE,
+        standby=BME280_STANDBY_1000,
+        iir_filter=BME280_FILTER_OFF,
+        osample_temp=None,
+        osample_pressure=None,
+        osample_humidity=None,
+    ):
+        """Configure the sampling of the sensor.
+
+        In forced mode, the sensor sleeps until read_compensated (or
+        start_measurement) triggers a conversion. In normal mode, it samples
+        continuously, waiting the standby time between conversions, so that a
+        read is a single burst fetch of the latest results. The oversampling
+        of each channel defaults to the mode given to the constructor."""
+        if power_mode not in [BME280_FORCED_MODE, BME280_NORMAL_MODE]:
+            raise ValueError(
+                "Unexpected power mode value {0}. Set power_mode to "
+                "BME280_FORCED_MODE or BME280_NORMAL_MODE".format(power_mode)
+            )
+        if not 0 <= standby <= 7:
+            raise ValueError("Unexpected standby value {0}.".format(standby))
+        if not 0 <= iir_filter <= 4:
+            raise ValueError("Unexpected iir_filter value {0}.".format(iir_filter))
+        self._osample_temp = self._mode if osample_temp is None else osample_temp
+        self._osample_pressure = (
+            self._mode if osample_pressure is None else osample_pressure
+        )
+        self._osample_humidity = (
+            self._mode if osample_humidity is None else osample_humidity
+        )
+        self._check_oversampling(self._osample_temp)
+        self._check_oversampling(self._osample_pressure)
+        self._check_oversampling(self._osample_humidity)
+        self._power_mode = power_mode
+
+        # The config register is only reliably written in sleep mode
+        self._device.write8(BME280_REGISTER_CONTROL, BME280_SLEEP_MODE)
+        self._device.write8(BME280_REGISTER_CONFIG, standby << 5 | iir_filter << 2)
+        # Changes to ctrl_hum only become effective after a write to ctrl_meas
+        self._device.write8(BME280_REGISTER_CONTROL_HUM, self._osample_humidity)
+        if power_mode == BME280_NORMAL_MODE:
+            self._device.write8(BME280_REGISTER_CONTROL, self._ctrl_meas())
+
+    def _ctrl_meas(self):
+        return self._osample_temp << 5 | self._osample_pressure << 2 | self._power_mode
+
+    def _load_calibration(self, cache=False):
+        """Load the trimming parameters, in two bulk reads (0x88 to 0xA1 and
+        0xE1 to 0xE7). If cache is True, they are kept in a file named after
+        the sensor address so that the next boot does not have to read them
+        from the sensor. Nothing tells the cached parameters of a replaced
+        sensor apart, so the file must then be deleted."""
+        filename = "bme280_{:02x}.cal".format(self._device._address)
+        calibration = None
+        if cache:
+            try:
+                with open(filename, "rb") as f:
+                    calibration = f.read()
+            except OSError:
+                pass
+        if calibration is None or len(calibration) != 33:
+            calibration = self._device.readList(
+                BME280_REGISTER_DIG_T1, 26
+            ) + self._device.readList(BME280_REGISTER_DIG_H2, 7)
+            if cache:
+                with open(filename, "wb") as f:
+                    f.write(calibration)
+
+        (
+            self.dig_T1,
+            self.dig_T2,
+            self.dig_T3,
+            self.dig_P1,
+            self.dig_P2,
+            self.dig_P3,
+            self.dig_P4,
+            self.dig_P5,
+            self.dig_P6,
+            self.dig_P7,
+            self.dig_P8,
+            self.dig_P9,
+            self.dig_H1,
+        ) = struct.unpack_from("<HhhHhhhhhhhhxB", calibration, 0)
+
+        self.dig_H2, self.dig_H3, h4, h45, h5, self.dig_H6 = struct.unpack_from(
+            "<hBbBbb", calibration, 26
+        )
+        self.dig_H4 = (h4 << 4) | (h45 & 0x0F)
+        self.dig_H5 = (h5 << 4) | (h45 >> 4 & 0x0F)
 
-        h4 = self._device.readS8(BME280_REGISTER_DIG_H4)
-        h4 = (h4 << 24) >> 20
-        self.dig_H4 = h4 | (self._device.readU8(BME280_REGISTER_DIG_H5) & 0x0F)
+    def start_measurement(self):
+        """Triggers a forced conversion without waiting for it.
 
-        h5 = self._device.readS8(BME280_REGISTER_DIG_H6)
-        h5 = (h5 << 24) >> 20
-        self.dig_H5 = h5 | (self._device.readU8(BME280_REGISTER_DIG_H5) >> 4 & 0x0F)
+        Returns the worst-case conversion time in microseconds, so that a
+        scheduler can run other tasks in the meantime and then call
+        read_compensated(trigger=False). In normal mode, nothing is triggered
+        and 0 is returned."""
+        if self._power_mode == BME280_NORMAL_MODE:
+            return 0
+        # ctrl_hum was written by configure and is kept by the sensor
+        self._device.write8(BME280_REGISTER_CONTROL, self._ctrl_meas())
+        sleep_time = 1250 + 2300 * (1 << self._osample_temp)
+
+        sleep_time = sleep_time + 2300 * (1 << self._osample_pressure) + 575
+        sleep_time = sleep_time + 2300 * (1 << self._osample_humidity) + 575
+        return sleep_time
+
+    def is_measuring(self):
+        """Returns True while a conversion is running (status register bit 3)."""
+        return bool(self._device.readU8(BME280_REGISTER_STATUS) & 0x08)
+
+    def pending_ms(self, start, timeout_us):
+        """Returns the time in milliseconds to wait before calling again for
+        the conversion started at start (a ticks_us value), or 0 once it is
+        completed, so that a scheduler can run other tasks meanwhile.
+
+        With poll_status, the status register is polled so that the wait only
+        lasts as long as the sensor actually takes, with timeout_us as an
+        upper bound. Otherwise, timeout_us is waited entirely."""
+        remaining_us = timeout_us - time.ticks_diff(time.ticks_us(), start)
+        if remaining_us <= 0:
+            return 0
+        if not self._poll_status:
+            return (remaining_us + 999) // 1000
+        return 1 if self.is_measuring() else 0
+
+    def wait_measurement(self, timeout_us):
+        """Waits for the running conversion to complete (see pending_ms)."""
+        start = time.ticks_us()
+        while True:
+            wait_ms = self.pending_ms(start, timeout_us)
+            if not wait_ms:
+                break
+            time.sleep_ms(wait_ms)
+
+    def _force_measurement(self):
+        """Triggers a forced conversion and waits until it is completed."""
+        self.wait_measurement(self.start_measurement())
 
     def read_raw_temp(self):
         """Reads the raw (uncompensated) temperature from the sensor."""
-        meas = self._mode
-        self._device.write8(BME280_REGISTER_CONTROL_HUM, meas)
-        meas = self._mode << 5 | self._mode << 2 | 1
-        self._device.write8(BME280_REGISTER_CONTROL, meas)
-        sleep_time = 1250 + 2300 * (1 << self._mode)
-
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        time.sleep_us(sleep_time)  # Wait the required time
+        self._force_measurement()
         msb = self._device.readU8(BME280_REGISTER_TEMP_DATA)
         lsb = self._device.readU8(BME280_REGISTER_TEMP_DATA + 1)
         xlsb = self._device.readU8(BME280_REGISTER_TEMP_DATA + 2)
@@ -235,10 +385,23 @@ class BME280:
         raw = (msb << 8) | lsb
         return raw
 
-    def read_temperature(self):
-        """Get the compensated temperature in 0.01 of a degree celsius."""
-        adc = self.read_raw_temp()
-        var1 = ((adc >> 3) - (self.dig_T1 << 1)) * (self.dig_T2 >> 11)
+    def read_raw_data(self, trigger=True):
+        """Reads the raw temperature, pressure and humidity from the sensor.
+
+        A single forced conversion is triggered (unless trigger is False, if
+        start_measurement was already called, or in normal mode), then the
+        whole data block (0xF7 to 0xFE) is fetched in one I2C transaction."""
+        if trigger and self._power_mode != BME280_NORMAL_MODE:
+            self._force_measurement()
+        data = self._data
+        self._device.readInto(BME280_REGISTER_PRESSURE_DATA, data)
+        raw_pressure = ((data[0] << 16) | (data[1] << 8) | data[2]) >> 4
+        raw_temp = ((data[3] << 16) | (data[4] << 8) | data[5]) >> 4
+        raw_humidity = (data[6] << 8) | data[7]
+        return raw_temp, raw_pressure, raw_humidity
+
+    def _compensate_temperature(self, adc):
+        var1 = (((adc >> 3) - (self.dig_T1 << 1)) * self.dig_T2) >> 11
         var2 = (
             ((((adc >> 4) - self.dig_T1) * ((adc >> 4) - self.dig_T1)) >> 12)
             * self.dig_T3
@@ -246,14 +409,12 @@ class BME280:
         self.t_fine = var1 + var2
         return (self.t_fine * 5 + 128) >> 8
 
-    def read_pressure(self):
-        """Gets the compensated pressure in Pascals."""
-        adc = self.read_raw_pressure()
+    def _compensate_pressure(self, adc):
         var1 = self.t_fine - 128000
         var2 = var1 * var1 * self.dig_P6
         var2 = var2 + ((var1 * self.dig_P5) << 17)
         var2 = var2 + (self.dig_P4 << 35)
-        var1 = ((var1 * var1 * self.dig_P3) >> 8) + ((var1 * self.dig_P2) >> 12)
+        var1 = ((var1 * var1 * self.dig_P3) >> 8) + ((var1 * self.dig_P2) << 12)
         var1 = (((1 << 47) + var1) * self.dig_P1) >> 33
         if var1 == 0:
             return 0
@@ -263,9 +424,7 @@ class BME280:
         var2 = (self.dig_P8 * p) >> 19
         return ((p + var1 + var2) >> 8) + (self.dig_P7 << 4)
 
-    def read_humidity(self):
-        adc = self.read_raw_humidity()
-        # print 'Raw humidity = {0:d}'.format (adc)
+    def _compensate_humidity(self, adc):
         h = self.t_fine - 76800
         h = (
             (((adc << 14) - (self.dig_H4 << 20) - (self.dig_H5 * h)) + 16384) >> 15
@@ -291,6 +450,40 @@ class BME280:
         h = 419430400 if h > 419430400 else h
         return h >> 12
 
+    def read_temperature(self):
+        """Get the compensated temperature in 0.01 of a degree celsius."""
+        return self.read_compensated()[0]
+
+    def read_pressure(self):
+        """Gets the compensated pressure in 1/256 of a Pascal."""
+        return self.read_compensated()[1]
+
+    def read_humidity(self):
+        """Gets the compensated humidity in 1/1024 of a percent."""
+        return self.read_compensated()[2]
+
+    def read_compensated(self, result=None, trigger=True):
+        """Get the compensated temperature, pressure and humidity from a
+        single conversion. The pressure and humidity are compensated with the
+        t_fine of that same conversion, so the three values are consistent.
+
+        Returns a (temperature, pressure, humidity) tuple where the
+        temperature is in 0.01 of a degree celsius, the pressure in 1/256 of
+        a Pascal and the humidity in 1/1024 of a percent. If a preallocated
+        sequence of 3 integers is given as result (e.g. array("i", [0] * 3)),
+        the values are written into it and it is returned instead, so that
+        nothing is allocated for the result."""
+        raw_temp, raw_pressure, raw_humidity = self.read_raw_data(trigger)
+        temperature = self._compensate_temperature(raw_temp)
+        pressure = self._compensate_pressure(raw_pressure)
+        humidity = self._compensate_humidity(raw_humidity)
+        if result is None:
+            return temperature, pressure, humidity
+        result[0] = temperature
+        result[1] = pressure
+        result[2] = humidity
+        return result
+
     @property
     def temperature(self):
         "Return the temperature in degrees."
@@ -0,0 +1,502 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Collector receiving the readings that the controllers post to the HTTP
+server, and writing them to InfluxDB in bulk:
+
+    python collector.py [--port 8080] [--influxdb http://localhost:8086]
+
+The readings of a controller are accepted as a JSON object, or an array of
+objects, optionally gzip-compressed. They are validated, converted to
+InfluxDB line protocol with the sensor_id tag of the X-Sensor-Id header (the
+address of the controller without it), and queued. The queue is written to
+InfluxDB in large batches, gathering the points of many controllers. When
+the queue is full, the controllers are answered 503 and keep their readings
+until later. When InfluxDB cannot be reached, the batches are appended to a
+spool file, which is sent once it is back.
+
+GET /stats returns the counters of the collector as JSON."""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from urllib.parse import urlsplit
+
+# The controller's modules run on CPython, with asyncio for uasyncio
+sys.modules.setdefault("uasyncio", asyncio)
+
+from encoders import LineProtocolEncoder
+from http_client import HttpClient, is_rejected
+
+try:
+    import config
+except ImportError:
+    from sim import load_config
+
+    config = load_config({})
+
+MAX_BODY_SIZE = 1 << 20
+MAX_READINGS = 5000  # per request
+FIELD_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]{0,63}$")
+SENSOR_ID = re.compile(r"[A-Za-z0-9_.:-]{1,64}$")
+# InfluxDB keeps timestamps as int64 nanoseconds, up to 2262
+MAX_TIMESTAMP = (1 << 63) // 10**9
+# Values are written with 2 decimals, so larger ones would lose precision
+MAX_VALUE = 1e15
+
+REASONS = {
+    200: "OK",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    415: "Unsupported Media Type",
+    503: "Service Unavailable",
+}
+
+
+async def read_request(reader, max_body_size=MAX_BODY_SIZE):
+    """Reads an HTTP/1.1 request and returns its method, path, version,
+    headers (with lowercase names) and body, or None if the connection was
+    closed before it. Raises ValueError for a malformed request, with the
+    status code to answer as its second argument."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, version = line.decode("latin-1").split()
+    except ValueError:
+        raise ValueError("Malformed request line", 400) from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, separator, value = line.decode("latin-1").partition(":")
+        if not separator:
+            raise ValueError("Malformed header", 400)
+        headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", ""):
+        raise ValueError("Chunked requests are not supported", 411)
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise ValueError("Bad Content-Length", 400)
+    if length > max_body_size:
+        raise ValueError("Request too large", 413)
+    body = await reader.readexactly(length)
+    return method, path, version, headers, body
+
+
+def write_response(writer, status, body=b"", headers=None):
+    head = "HTTP/1.1 {} {}\r\nContent-Length: {}\r\n".format(
+        status, REASONS.get(status, "-"), len(body)
+    )
+    for name in headers or ():
+        head += "{}: {}\r\n".format(name, headers[name])
+    writer.write(head.encode() + b"\r\n" + body)
+
+
+def gunzip(body, max_size=MAX_BODY_SIZE):
+    """Returns a gzip-compressed body decompressed, raising ValueError as soon
+    as it exceeds max_size bytes rather than inflating it all in memory."""
+    decompressor = zlib.decompressobj(wbits=31)
+    data = decompressor.decompress(body, max_size + 1)
+    if len(data) > max_size:
+        raise ValueError("Request too large")
+    if not decompressor.eof:
+        raise ValueError("Truncated gzip data")
+    return data
+
+
+def validate(data):
+    """Returns the list of readings of a decoded JSON payload, or raises
+    ValueError if they are not valid readings of a controller."""
+    readings = data if isinstance(data, list) else [data]
+    if not readings or len(readings) > MAX_READINGS:
+        raise ValueError(f"Expected 1 to {MAX_READINGS} readings")
+    for reading in readings:
+        if not isinstance(reading, dict):
+            raise ValueError("A reading must be an object")
+        timestamp = reading.get("timestamp")
+        if (
+            isinstance(timestamp, bool)
+            or not isinstance(timestamp, int)
+            or not 0 <= timestamp <= MAX_TIMESTAMP
+        ):
+            raise ValueError("A reading needs an integer timestamp in seconds")
+        fields = 0
+        for name in reading:
+            value = reading[name]
+            if not FIELD_NAME.match(name):
+                raise ValueError(f"Invalid field name {name!r}")
+            if name == "pump":
+                if not isinstance(value, bool):
+                    raise ValueError("pump must be true or false")
+            elif name != "timestamp" and value != "N/A":
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    raise ValueError(f"Invalid value for {name}")
+                if not -MAX_VALUE <= value <= MAX_VALUE:  # also NaN
+                    raise ValueError(f"Invalid value for {name}")
+            if name != "timestamp" and value != "N/A":
+                fields += 1
+        if not fields:
+            raise ValueError("A reading needs at least one value")
+    return readings
+
+
+class Spool:
+    """Append-only file of line protocol, one point per line, kept while
+    InfluxDB cannot be reached. The points are read back in order, the offset
+    of the next unsent point being saved next to the file so that the points
+    sent are not sent again after a restart."""
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.max_size = max_size
+        try:
+            with open(self.offset_path) as f:
+                self.offset = int(f.read())
+        except (OSError, ValueError):
+            self.offset = 0
+        try:
+            self.size = os.path.getsize(path)
+        except OSError:
+            self.size = 0
+        if self.offset > self.size:
+            self.offset = 0
+
+    def __len__(self):
+        # Size in bytes of the points not sent yet
+        return self.size - self.offset
+
+    def append(self, data):
+        """Appends the lines of data, returns False if the spool is full."""
+        if self.size + len(data) + 1 > self.max_size:
+            return False
+        with open(self.path, "ab") as f:
+            f.write(data + b"\n")
+        self.size += len(data) + 1
+        return True
+
+    def read(self, max_points):
+        """Returns up to max_points lines from the offset, and the offset
+        after them."""
+        if not len(self):
+            return b"", 0, self.offset
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            lines = []
+            for line in f:
+                lines.append(line.rstrip(b"\n"))
+                if len(lines) >= max_points:
+                    break
+        data = b"\n".join(lines)
+        return data, len(lines), self.offset + len(data) + 1 if lines else self.offset
+
+    def advance(self, offset):
+        """Marks the points up to offset as sent. The file is emptied once
+        they all are."""
+        if offset >= self.size:
+            for path in (self.path, self.offset_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.offset = self.size = 0
+            return
+        self.offset = offset
+        with open(self.offset_path, "w") as f:
+            f.write(str(offset))
+
+
+class Collector:
+    def __init__(self, args):
+        self.args = args
+        self.measurement = args.measurement
+        self.encoders = {}  # one per sensor_id
+        self.queue = collections.deque()  # line protocol, with its points
+        self.queued_points = 0
+        self.ready = asyncio.Event()
+        self.spool = Spool(args.spool, args.spool_max_size)
+        self.influxdb_up = True
+        url = urlsplit(args.influxdb)
+        self.influxdb = HttpClient(
+            url.hostname,
+            url.port or 8086,
+            f"/api/v2/write?org={args.org}&bucket={args.bucket}&precision=s",
+            {
+                "Authorization": f"Token {args.token}",
+                "Content-Type": "text/plain; charset=utf-8",
+                "Accept": "application/json",
+            },
+            args.timeout,
+        )
+        self.stats = {
+            "requests": 0,
+            "readings_accepted": 0,
+            "requests_rejected": 0,
+            "requests_refused": 0,  # 503, the queue being full
+            "points_written": 0,
+            "points_dropped": 0,  # rejected by InfluxDB, or spool full
+            "writes": 0,
+            "write_failures": 0,
+        }
+
+    async def handle(self, reader, writer):
+        # Requests are read one after the other on kept-alive connections
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ValueError as e:
+                    message, status = e.args
+                    write_response(writer, status, message.encode())
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                status, response, response_headers = self.respond(
+                    method, path, headers, body, peer
+                )
+                write_response(writer, status, response, response_headers)
+                await writer.drain()
+                if version == "HTTP/1.0" or headers.get("connection") == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, method, path, headers, body, peer):
+        if method == "GET" and path == "/stats":
+            return 200, json.dumps(self.get_stats()).encode(), {
+                "Content-Type": "application/json"
+            }
+        if method != "POST":
+            return 405, b"", {"Allow": "POST"}
+        self.stats["requests"] += 1
+        try:
+            encoding = headers.get("content-encoding", "identity")
+            if encoding == "gzip":
+                body = gunzip(body)
+            elif encoding != "identity":
+                self.stats["requests_rejected"] += 1
+                return 415, b"Unsupported Content-Encoding", None
+            readings = validate(json.loads(body))
+        except (ValueError, zlib.error) as e:  # gzip and JSON errors
+            self.stats["requests_rejected"] += 1
+            return 400, str(e).encode(), None
+
+        if self.queued_points + len(readings) > self.args.max_queued_points:
+            # Back-pressure: the controller keeps the readings for later
+            self.stats["requests_refused"] += 1
+            return 503, b"", {"Retry-After": int(self.args.retry_interval)}
+        # The points of many controllers are written together, so one id
+        # that would make a malformed line must not get into a batch
+        sensor_id = headers.get("x-sensor-id") or (peer[0] if peer else "unknown")
+        if not SENSOR_ID.match(sensor_id):
+            self.stats["requests_rejected"] += 1
+            return 400, b"Invalid X-Sensor-Id", None
+        try:
+            data = self.encode(sensor_id, readings)
+        except (ValueError, OverflowError) as e:
+            # Only this request is refused, the batches are left untouched
+            self.stats["requests_rejected"] += 1
+            return 400, str(e).encode(), None
+        self.enqueue(data, len(readings))
+        self.stats["readings_accepted"] += len(readings)
+        return 204, b"", None
+
+    def encode(self, sensor_id, readings):
+        encoder = self.encoders.get(sensor_id)
+        if encoder is None:
+            encoder = LineProtocolEncoder(self.measurement, {"sensor_id": sensor_id})
+            self.encoders[sensor_id] = encoder
+        return bytes(encoder.encode(readings))
+
+    def enqueue(self, data, points):
+        self.queue.append((data, points))
+        self.queued_points += points
+        if self.queued_points >= self.args.batch_points:
+            self.ready.set()
+
+    def take_batch(self):
+        # Gathers the queued points of many controllers, up to batch_points
+        chunks = []
+        points = 0
+        while self.queue and (
+            not chunks or points + self.queue[0][1] <= self.args.batch_points
+        ):
+            data, n = self.queue.popleft()
+            chunks.append(data)
+            points += n
+        self.queued_points -= points
+        return b"\n".join(chunks), points
+
+    async def write(self, data, points):
+        """Writes a batch to InfluxDB. Returns False if InfluxDB could not
+        take it, for it to be kept."""
+        self.stats["writes"] += 1
+        try:
+            status_code = await self.influxdb.post(data)
+        except Exception as e:
+            print("Could not write to InfluxDB:", e)
+            status_code = None
+        if status_code is not None and status_code < 300:
+            self.stats["points_written"] += points
+            return True
+        if status_code is not None and is_rejected(status_code):
+            # Sending them again would not help
+            print(f"{points} points rejected by InfluxDB (HTTP {status_code}).")
+            self.stats["points_dropped"] += points
+            return True
+        if status_code is not None:
+            print(f"Could not write to InfluxDB (HTTP {status_code}).")
+        self.stats["write_failures"] += 1
+        return False
+
+    def keep(self, data, points):
+        if not self.spool.append(data):
+            print(f"The spool is full, {points} points dropped.")
+            self.stats["points_dropped"] += points
+
+    async def writer(self):
+        # The queue is written once batch_points are waiting, or after
+        # flush_interval seconds, the points coming in during a write being
+        # written together by the next one. While InfluxDB is down, the queue
+        # goes to the spool, and the oldest spooled points are written every
+        # retry_interval seconds until InfluxDB takes them. The spool is then
+        # sent whenever the queue is empty.
+        retry_at = 0
+        while True:
+            if self.queued_points < self.args.batch_points and not (
+                self.influxdb_up and len(self.spool)
+            ):
+                self.ready.clear()
+                try:
+                    await asyncio.wait_for(self.ready.wait(), self.args.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if not self.influxdb_up:
+                while self.queue:
+                    self.keep(*self.take_batch())
+                if time.monotonic() < retry_at:
+                    continue
+                data, points, offset = self.spool.read(self.args.batch_points)
+                if points and not await self.write(data, points):
+                    retry_at = time.monotonic() + self.args.retry_interval
+                    continue
+                self.spool.advance(offset)
+                self.influxdb_up = True
+                print("InfluxDB is back.")
+            elif self.queue:
+                data, points = self.take_batch()
+                if not await self.write(data, points):
+                    self.keep(data, points)
+                    self.influxdb_up = False
+                    retry_at = time.monotonic() + self.args.retry_interval
+            elif len(self.spool):
+                data, points, offset = self.spool.read(self.args.batch_points)
+                if await self.write(data, points):
+                    self.spool.advance(offset)
+                else:
+                    self.influxdb_up = False
+                    retry_at = time.monotonic() + self.args.retry_interval
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["queued_points"] = self.queued_points
+        stats["spooled_bytes"] = len(self.spool)
+        stats["influxdb_up"] = self.influxdb_up
+        return stats
+
+    async def serve(self):
+        server = await asyncio.start_server(
+            self.handle, self.args.host, self.args.port, backlog=1024
+        )
+        print(f"Collector listening on {self.args.host}:{self.args.port}")
+        if len(self.spool):
+            print(f"{len(self.spool)} bytes of points to send from the spool.")
+        async with server:
+            await self.writer()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Collector writing the readings of the controllers to InfluxDB."
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=config.HTTP_SERVER_PORT)
+    parser.add_argument(
+        "--influxdb",
+        default=f"http://{config.INFLUXDB_URL}:{config.INFLUXDB_PORT}",
+        help="URL of InfluxDB",
+    )
+    parser.add_argument("--org", default=config.ORGANIZATION)
+    parser.add_argument("--bucket", default=config.BUCKET)
+    parser.add_argument("--token", default=config.INFLUXDB_TOKEN)
+    parser.add_argument("--measurement", default=config.ORGANIZATION)
+    parser.add_argument("--timeout", type=float, default=10, help="seconds per write")
+    parser.add_argument(
+        "--batch-points", type=int, default=5000, help="points per write to InfluxDB"
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=1.0,
+        help="maximum seconds a point waits to be written",
+    )
+    parser.add_argument(
+        "--max-queued-points",
+        type=int,
+        default=100000,
+        help="points queued before refusing the requests",
+    )
+    parser.add_argument("--spool", default="collector.spool", help="spool file")
+    parser.add_argument(
+        "--spool-max-size", type=int, default=1 << 30, help="bytes, 1 GB by default"
+    )
+    parser.add_argument(
+        "--retry-interval",
+        type=float,
+        default=10,
+        help="seconds between writes while InfluxDB is down",
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(Collector(args).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
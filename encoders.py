@@ -0,0 +1,163 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Encoders writing readings as InfluxDB line protocol or JSON into a
+reusable buffer."""
+
+
+def escape_tag(text):
+    """Escapes a tag key or value for the line protocol."""
+    return text.replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+class Encoder:
+    """Writes payloads into a preallocated bytearray, which only grows if a
+    payload does not fit. The encoded payload is returned as a memoryview of
+    that buffer, valid until the next call to encode.
+
+    A reading is a dict of values (numbers, booleans or the "N/A" string),
+    with its "timestamp". Numbers are written with at most 2 decimals.
+    """
+
+    def __init__(self, size):
+        self._buf = bytearray(size)
+        self._pos = 0
+        self._names = {}
+
+    def _reserve(self, size):
+        end = self._pos + size
+        if end > len(self._buf):
+            buf = bytearray(max(end, 2 * len(self._buf)))
+            buf[: self._pos] = self._buf[: self._pos]
+            self._buf = buf
+        return end
+
+    def _write(self, data):
+        end = self._reserve(len(data))
+        self._buf[self._pos : end] = data
+        self._pos = end
+
+    def _write_byte(self, byte):
+        self._pos = self._reserve(1)
+        self._buf[self._pos - 1] = byte
+
+    def _write_int(self, value):
+        # Writes the decimal digits of value without building a string
+        if value < 0:
+            self._write_byte(0x2D)  # -
+            value = -value
+        divisor = 1
+        while divisor * 10 <= value:
+            divisor *= 10
+        while divisor:
+            self._write_byte(0x30 + value // divisor)
+            value %= divisor
+            divisor //= 10
+
+    def _write_number(self, value):
+        if isinstance(value, int):
+            self._write_int(value)
+            return
+        value = round(value * 100)
+        if value < 0:
+            self._write_byte(0x2D)  # -
+            value = -value
+        self._write_int(value // 100)
+        self._write_byte(0x2E)  # .
+        self._write_byte(0x30 + value // 10 % 10)
+        self._write_byte(0x30 + value % 10)
+
+    def _name(self, key, template):
+        # The encoded field names are built once per key
+        name = self._names.get(key)
+        if name is None:
+            name = template.format(key).encode()
+            self._names[key] = name
+        return name
+
+    def encode(self, readings):
+        """Encodes a list of readings and returns the payload."""
+        self._pos = 0
+        self._encode(readings)
+        return memoryview(self._buf)[: self._pos]
+
+
+class LineProtocolEncoder(Encoder):
+    """Encodes readings as InfluxDB line protocol, one line per reading. The
+    measurement and tags are encoded once. The "pump" value is written as
+    the pump_started field, and missing values are left out, InfluxDB
+    rejecting them."""
+
+    def __init__(self, measurement, tags, size=1024):
+        Encoder.__init__(self, size)
+        prefix = measurement.replace(",", "\\,").replace(" ", "\\ ")
+        for key in tags:
+            prefix += ",{}={}".format(escape_tag(key), escape_tag(str(tags[key])))
+        self._prefix = prefix.encode()
+
+    def _encode(self, readings):
+        for i, env_data in enumerate(readings):
+            if i:
+                self._write(b"\n")
+            self._write(self._prefix)
+            separator = b" "
+            for key in env_data:
+                value = env_data[key]
+                if key == "timestamp" or value == "N/A":
+                    continue
+                self._write(separator)
+                separator = b","
+                if key == "pump":
+                    self._write(b"pump_started=")
+                    self._write(b"True" if value else b"False")
+                else:
+                    self._write(self._name(key, "{}="))
+                    self._write_number(value)
+            self._write(b" ")
+            self._write_int(env_data["timestamp"])
+
+
+class JsonEncoder(Encoder):
+    """Encodes a single reading as a JSON object, or several as an array."""
+
+    def _encode(self, readings):
+        if len(readings) > 1:
+            self._write(b"[")
+        for i, env_data in enumerate(readings):
+            if i:
+                self._write(b", ")
+            separator = b"{"
+            for key in env_data:
+                value = env_data[key]
+                self._write(separator)
+                separator = b", "
+                self._write(self._name(key, '"{}": '))
+                if value is True:
+                    self._write(b"true")
+                elif value is False:
+                    self._write(b"false")
+                elif isinstance(value, str):
+                    self._write(b'"')
+                    self._write(value.encode())
+                    self._write(b'"')
+                else:
+                    self._write_number(value)
+            self._write(b"}")
+        if len(readings) > 1:
+            self._write(b"]")
@@ -0,0 +1,190 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Minimal HTTP/1.1 client keeping its connection to a server open."""
+
+import io
+import uasyncio as asyncio
+
+# Compression is optional, the deflate module is not in every firmware
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+
+def is_rejected(status_code):
+    """Returns True if the body of a request answered status_code would be
+    rejected again if sent again, being malformed (400) or too large (413).
+    Other errors (authentication, wrong path, server errors) may be fixed on
+    the server side, so the body is worth keeping for a retry."""
+    return status_code in (400, 413)
+
+
+def gzip(data):
+    """Returns data compressed in the gzip format."""
+    stream = io.BytesIO()
+    with deflate.DeflateIO(stream, deflate.GZIP) as f:
+        f.write(data)
+    return stream.getvalue()
+
+
+class HttpClient:
+    """Sends POST requests to one endpoint (a path on a server, with fixed
+    headers) over a single kept-alive connection, which is reused from one
+    request to the next.
+
+    The request line and headers are encoded once, only the length of the
+    body changing from one request to the next. The connection is opened on
+    the first request, and again after it was closed by the server or by an
+    error. The whole response is always read, so that the connection is
+    ready for the next request. Each request is bounded by timeout seconds.
+
+    Bodies of at least compress_threshold bytes are sent gzip-compressed, if
+    the deflate module is available (0 disables the compression).
+    """
+
+    def __init__(self, host, port, path, headers, timeout, compress_threshold=0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.compress_threshold = compress_threshold if deflate else 0
+        self._reader = None
+        self._writer = None
+        self._responding = False  # a byte of the response was received
+        self.sent_size = 0  # size of the last body sent, once compressed
+        head = "POST {} HTTP/1.1\r\nHost: {}\r\n".format(path, host)
+        for name in headers:
+            head += "{}: {}\r\n".format(name, headers[name])
+        self._head = (head + "Content-Length: ").encode()
+        self._gzip_head = (
+            head + "Content-Encoding: gzip\r\nContent-Length: "
+        ).encode()
+
+    async def close(self):
+        """Closes the connection, if it is open."""
+        writer = self._writer
+        self._reader = None
+        self._writer = None
+        if writer is not None:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def post(self, body):
+        """Sends body (a bytes-like object) and returns the HTTP status code
+        of the response.
+
+        A kept-alive connection may have been closed by the server since the
+        last request, so a request failing on a reused connection before any
+        byte of the response is retried once on a new one. Timeouts are not
+        retried, the server may have taken the body, and the whole request,
+        retry included, is bounded by timeout seconds. After an error, the
+        connection is closed, as it may be out of sync with the server."""
+        head = self._head
+        if self.compress_threshold and len(body) >= self.compress_threshold:
+            try:
+                body = gzip(body)
+                head = self._gzip_head
+            except Exception as e:
+                # The body is sent uncompressed. Short of memory, compression
+                # is tried again next time. Otherwise, the firmware cannot
+                # compress (a deflate module built without compression has
+                # no DeflateIO.write), so it is turned off
+                print("Could not compress the data:", e)
+                if not isinstance(e, MemoryError):
+                    self.compress_threshold = 0
+        try:
+            return await asyncio.wait_for(self._post(head, body), self.timeout)
+        except Exception:
+            await self.close()
+            raise
+
+    async def _post(self, head, body):
+        if self._writer is not None:
+            try:
+                return await self._exchange(head, body)
+            except (OSError, EOFError):
+                if self._responding:
+                    raise
+                await self.close()  # closed by the server, it is opened again
+        return await self._exchange(head, body)
+
+    async def _exchange(self, head, body):
+        self._responding = False
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        self._writer.write(head)
+        self._writer.write(("%d\r\n\r\n" % len(body)).encode())
+        self._writer.write(body)
+        self.sent_size = len(body)
+        await self._writer.drain()
+        return await self._read_response()
+
+    async def _read_response(self):
+        reader = self._reader
+        line = await reader.readline()
+        if not line:
+            raise EOFError("Connection closed by the server")
+        self._responding = True
+        status_code = int(line.split(None, 2)[1])
+
+        length = None
+        chunked = False
+        keep_alive = not line.startswith(b"HTTP/1.0")
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n":
+                break
+            name, value = line.split(b":", 1)
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = value == b"chunked"
+            elif name == b"connection":
+                keep_alive = value != b"close"
+
+        # The body is read and dropped
+        if status_code == 204 or status_code == 304 or status_code < 200:
+            pass  # no body
+        elif chunked:
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b""):
+                        pass
+                    break
+                await reader.readexactly(size + 2)  # the chunk and its CRLF
+        elif length is not None:
+            await reader.readexactly(length)
+        else:
+            # Without a length, the body ends when the connection is closed
+            while await reader.read(128):
+                pass
+            keep_alive = False
+
+        if not keep_alive:
+            await self.close()
+        return status_code
@@ -8,7 +8,6 @@ https://github.com/dhylands/python_lcd
    This was tested with: https://www.wemos.cc/product/d1-mini.html"""
 
 import utime
-import gc
 
 from lcd_api import LcdApi
 from machine import I2C
@@ -29,6 +28,9 @@ class I2cLcd(LcdApi):
     def __init__(self, i2c, i2c_addr, num_lines, num_columns):
         self.i2c = i2c
         self.i2c_addr = i2c_addr
+        # Preallocated buffers: one byte (4 strobes) and one full line
+        self._byte_buf = bytearray(4)
+        self._data_buf = bytearray(4 * min(num_columns, 40))
         self.i2c.writeto(self.i2c_addr, bytes([0]))
         utime.sleep_ms(20)  # Allow LCD time to powerup
         # Send reset 3 times
@@ -46,53 +48,64 @@ class I2cLcd(LcdApi):
         if num_lines > 1:
             cmd |= self.LCD_FUNCTION_2LINES
         self.hal_write_command(cmd)
-        gc.collect()
 
     def hal_write_init_nibble(self, nibble):
         # Writes an initialization nibble to the LCD.
         # This particular function is only used during initialization.
         byte = ((nibble >> 4) & 0x0F) << SHIFT_DATA
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        gc.collect()
+        buf = self._byte_buf
+        buf[0] = byte | MASK_E
+        buf[1] = byte
+        self.i2c.writeto(self.i2c_addr, memoryview(buf)[:2])
 
     def hal_backlight_on(self):
         # Allows the hal layer to turn the backlight on
         self.i2c.writeto(self.i2c_addr, bytes([1 << SHIFT_BACKLIGHT]))
-        gc.collect()
 
     def hal_backlight_off(self):
         # Allows the hal layer to turn the backlight off
         self.i2c.writeto(self.i2c_addr, bytes([0]))
-        gc.collect()
+
+    def _pack_byte(self, buf, pos, rs, value):
+        # Packs the four PCF8574 writes (high nibble then low nibble, each
+        # strobed with E) needed to send one byte, starting at buf[pos].
+        # Data is latched on the falling edge of E.
+        byte = (
+            rs
+            | (self.backlight << SHIFT_BACKLIGHT)
+            | (((value >> 4) & 0x0F) << SHIFT_DATA)
+        )
+        buf[pos] = byte | MASK_E
+        buf[pos + 1] = byte
+        byte = rs | (self.backlight << SHIFT_BACKLIGHT) | ((value & 0x0F) << SHIFT_DATA)
+        buf[pos + 2] = byte | MASK_E
+        buf[pos + 3] = byte
 
     def hal_write_command(self, cmd):
-        # Write a command to the LCD. Data is latched on the falling edge of E.
-        byte = (self.backlight << SHIFT_BACKLIGHT) | (((cmd >> 4) & 0x0F) << SHIFT_DATA)
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        byte = (self.backlight << SHIFT_BACKLIGHT) | ((cmd & 0x0F) << SHIFT_DATA)
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
+        # Write a command to the LCD, in a single I2C transaction.
+        self._pack_byte(self._byte_buf, 0, 0, cmd)
+        self.i2c.writeto(self.i2c_addr, self._byte_buf)
         if cmd <= 3:
             # The home and clear commands require a worst case delay of 4.1 msec
             utime.sleep_ms(5)
-        gc.collect()
 
     def hal_write_data(self, data):
-        # Write data to the LCD. Data is latched on the falling edge of E.
-        byte = (
-            MASK_RS
-            | (self.backlight << SHIFT_BACKLIGHT)
-            | (((data >> 4) & 0x0F) << SHIFT_DATA)
-        )
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        byte = (
-            MASK_RS
-            | (self.backlight << SHIFT_BACKLIGHT)
-            | ((data & 0x0F) << SHIFT_DATA)
-        )
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        gc.collect()
\ No newline at end of file
+        # Write data to the LCD, in a single I2C transaction.
+        self._pack_byte(self._byte_buf, 0, MASK_RS, data)
+        self.i2c.writeto(self.i2c_addr, self._byte_buf)
+
+    def hal_write_data_bytes(self, data):
+        # Write a run of characters to the LCD. The strobe sequences of the
+        # characters are packed in a preallocated buffer which is sent in one
+        # I2C transaction per buffer length (one full line).
+        buf = self._data_buf
+        size = len(buf)
+        pos = 0
+        for value in data:
+            self._pack_byte(buf, pos, MASK_RS, value)
+            pos += 4
+            if pos == size:
+                self.i2c.writeto(self.i2c_addr, buf)
+                pos = 0
+        if pos:
+            self.i2c.writeto(self.i2c_addr, memoryview(buf)[:pos])
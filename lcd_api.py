@@ -64,6 +64,10 @@ class LcdApi:
         self.cursor_y = 0
         self.implied_newline = False
         self.backlight = True
+        # Shadow copy of the characters on the display, and a scratch frame
+        # used by update() to render the next screen
+        self.frame = bytearray(self.num_lines * self.num_columns)
+        self._next_frame = bytearray(self.num_lines * self.num_columns)
         self.display_off()
         self.backlight_on()
         self.clear()
@@ -79,6 +83,11 @@ class LcdApi:
         self.hal_write_command(self.LCD_HOME)
         self.cursor_x = 0
         self.cursor_y = 0
+        self._blank(self.frame)
+
+    def _blank(self, frame):
+        for i in range(len(frame)):
+            frame[i] = 0x20
 
     def show_cursor(self):
         """Causes the cursor to be made visible."""
@@ -157,21 +166,109 @@ class LcdApi:
                 self.cursor_x = self.num_columns
         else:
             self.hal_write_data(ord(char))
+            if self.cursor_x < self.num_columns and self.cursor_y < self.num_lines:
+                self.frame[self.cursor_y * self.num_columns + self.cursor_x] = (
+                    ord(char) & 0xFF
+                )
             self.cursor_x += 1
         if self.cursor_x >= self.num_columns:
-            self.cursor_x = 0
-            self.cursor_y += 1
-            self.implied_newline = char != "\n"
+            self._wrap(char)
+        if self.cursor_y >= self.num_lines:
+            self.cursor_y = 0
+
+    def _wrap(self, char):
+        # The HD44780 auto-increments the address within a line, but the
+        # lines are interleaved in its memory, so the cursor is only moved
+        # explicitly when going to the next line.
+        self.cursor_x = 0
+        self.cursor_y += 1
+        self.implied_newline = char != "\n"
         if self.cursor_y >= self.num_lines:
             self.cursor_y = 0
         self.move_to(self.cursor_x, self.cursor_y)
 
+    def _write_run(self, start):
+        # Writes the characters of the current line from start to the cursor,
+        # which were already put in the frame buffer.
+        if self.cursor_x > start:
+            offset = self.cursor_y * self.num_columns
+            self.hal_write_data_bytes(
+                memoryview(self.frame)[offset + start : offset + self.cursor_x]
+            )
+
     def putstr(self, string):
         """Write the indicated string to the LCD at the current cursor
         position and advances the cursor position appropriately.
+
+        The characters are streamed in runs, one per line, and the cursor is
+        only moved at line breaks and wraps.
         """
+        frame = self.frame
+        num_columns = self.num_columns
+        start = self.cursor_x
         for char in string:
-            self.putchar(char)
+            if char == "\n":
+                if not self.implied_newline:
+                    self._write_run(start)
+                    self.cursor_x = num_columns
+            else:
+                frame[self.cursor_y * num_columns + self.cursor_x] = ord(char) & 0xFF
+                self.cursor_x += 1
+            if self.cursor_x >= num_columns:
+                if char != "\n":
+                    self._write_run(start)
+                self._wrap(char)
+                start = 0
+        self._write_run(start)
+
+    def update(self, string):
+        """Displays the indicated string as the whole screen, starting at the
+        top left corner, but only writes the characters that differ from
+        what is currently displayed, with one cursor move per changed run.
+
+        Newlines and line wraps are handled like putstr does, and the rest of
+        the screen is blanked. This is meant to replace clear() followed by
+        putstr() for periodic refreshes.
+        """
+        frame = self._next_frame
+        self._blank(frame)
+        num_columns = self.num_columns
+        x = 0
+        y = 0
+        implied_newline = False
+        for char in string:
+            if char == "\n":
+                if not implied_newline:
+                    x = num_columns
+            else:
+                frame[y * num_columns + x] = ord(char) & 0xFF
+                x += 1
+            if x >= num_columns:
+                x = 0
+                y += 1
+                implied_newline = char != "\n"
+            if y >= self.num_lines:
+                y = 0
+
+        current = self.frame
+        data = memoryview(frame)
+        for y in range(self.num_lines):
+            offset = y * num_columns
+            x = 0
+            while x < num_columns:
+                if frame[offset + x] == current[offset + x]:
+                    x += 1
+                    continue
+                start = x
+                while x < num_columns and frame[offset + x] != current[offset + x]:
+                    current[offset + x] = frame[offset + x]
+                    x += 1
+                self.move_to(start, y)
+                self.hal_write_data_bytes(data[offset + start : offset + x])
+                self.cursor_x = x
+        if self.cursor_x >= num_columns:
+            # The display address does not follow the line order on 4 lines
+            self.move_to(0, (self.cursor_y + 1) % self.num_lines)
 
     def custom_char(self, location, charmap):
         """Write a character to one of the 8 CGRAM locations, available
@@ -215,6 +312,15 @@ class LcdApi:
         """
         raise NotImplementedError
 
+    def hal_write_data_bytes(self, data):
+        """Write a run of characters (a bytes-like object) to the LCD.
+
+        A derived HAL class may implement this function to send the whole
+        run at once. By default, the characters are written one by one.
+        """
+        for value in data:
+            self.hal_write_data(value)
+
     def hal_sleep_us(self, usecs):
         """Sleep for some time (given in microseconds)."""
         time.sleep_us(usecs)
@@ -0,0 +1,412 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Load generator for the uplink path: simulates many controllers posting
+their readings to the HTTP server and to InfluxDB, with the encoders and the
+HTTP client of the controller, and reports the throughput and the latency.
+
+    python loadgen.py run --controllers 500 --period 1 --duration 60
+    python loadgen.py influxdb --port 8086
+
+Like main.py, each controller sends its readings in batches, keeps them while
+the network is down (see --outage-every) and sends them in batches when it
+comes back. The influxdb command starts a local stand-in of the InfluxDB
+write API, which also accepts the JSON posts of the HTTP uplink, to test
+without a real server."""
+
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+# The controller's modules run on CPython, with asyncio for uasyncio
+sys.modules.setdefault("uasyncio", asyncio)
+
+from sim import deflate
+
+sys.modules.setdefault("deflate", deflate)
+
+from collector import read_request, write_response
+from encoders import JsonEncoder, LineProtocolEncoder
+from http_client import HttpClient, is_rejected
+
+try:
+    import config
+except ImportError:
+    from sim import load_config
+
+    config = load_config({})
+
+
+def percentile(latencies, fraction):
+    # latencies must be sorted
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+class Stats:
+    def __init__(self):
+        self.requests = 0
+        self.readings = 0
+        self.bytes = 0
+        self.latencies = []  # in seconds, of the answered requests
+        self.errors = {}  # number of failed requests, by status code or error
+
+    def add(self, other):
+        self.requests += other.requests
+        self.readings += other.readings
+        self.bytes += other.bytes
+        self.latencies += other.latencies
+        for error in other.errors:
+            self.errors[error] = self.errors.get(error, 0) + other.errors[error]
+
+    def summary(self, seconds):
+        latencies = sorted(self.latencies)
+        if latencies:
+            latency = "p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000,
+                latencies[-1] * 1000,
+            )
+        else:
+            latency = "no answer"
+        errors = ", ".join(f"{error}: {n}" for error, n in sorted(self.errors.items()))
+        return "{:.1f} req/s, {:.1f} readings/s, {:.1f} kB/s, {}{}".format(
+            self.requests / seconds,
+            self.readings / seconds,
+            self.bytes / seconds / 1000,
+            latency,
+            f", errors {errors}" if errors else "",
+        )
+
+
+class Controller:
+    """One simulated controller, with its own connections to the servers."""
+
+    def __init__(self, number, args, stats):
+        self.args = args
+        self.stats = stats
+        self.uplinks = []
+        sensor_id = f"loadgen_{number:04d}"
+        size = 128 * max(args.batch, args.backfill_batch)
+        if args.http:
+            url = urlsplit(args.http)
+            headers = {
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "X-Sensor-Id": sensor_id,
+            }
+            client = HttpClient(
+                url.hostname,
+                url.port or 80,
+                url.path or "/",
+                headers,
+                args.timeout,
+                args.compress,
+            )
+            self.uplinks.append(("http", client, JsonEncoder(size)))
+        if args.influxdb:
+            url = urlsplit(args.influxdb)
+            write_path = f"/api/v2/write?org={config.ORGANIZATION}&bucket={config.BUCKET}&precision=s"
+            headers = {
+                "Authorization": f"Token {config.INFLUXDB_TOKEN}",
+                "Content-Type": "text/plain; charset=utf-8",
+                "Accept": "application/json",
+            }
+            client = HttpClient(
+                url.hostname,
+                url.port or 8086,
+                write_path,
+                headers,
+                args.timeout,
+                args.compress,
+            )
+            encoder = LineProtocolEncoder(
+                config.ORGANIZATION, {"sensor_id": sensor_id}, size
+            )
+            self.uplinks.append(("influxdb", client, encoder))
+        self.temperature = random.uniform(-5, 5)
+        self.pump = False
+        self.batch = []
+        self.backlog = []  # readings kept while they cannot be sent
+
+    def read(self):
+        # A random walk around the setpoints of the pump
+        self.temperature += random.uniform(-0.5, 0.5)
+        if self.temperature >= config.START_TEMP:
+            self.pump = True
+        elif self.temperature <= config.STOP_TEMP:
+            self.pump = False
+        return {
+            "temperature": round(self.temperature, 1),
+            "humidity": round(random.uniform(60, 100), 1),
+            "pressure": random.randint(980, 1030),
+            "timestamp": int(time.time()),
+            "pump": self.pump,
+        }
+
+    async def send(self, readings):
+        # Returns True once every server has the readings or rejected them,
+        # like send_readings
+
+        delivered = True
+        for target, client, encoder in self.uplinks:
+            stats = self.stats[target]
+            payload = encoder.encode(readings)
+            start = time.perf_counter()
+            try:
+                status_code = await client.post(payload)
+            except Exception as e:
+                error = type(e).__name__
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+                delivered = False
+                continue
+            stats.latencies.append(time.perf_counter() - start)
+            stats.requests += 1
+            stats.bytes += client.sent_size  # compressed with --compress
+            if status_code < 300:
+                stats.readings += len(readings)
+            else:
+                stats.errors[status_code] = stats.errors.get(status_code, 0) + 1
+                if not is_rejected(status_code):
+                    delivered = False
+        return delivered
+
+    def keep(self, readings):
+        self.backlog += readings
+        del self.backlog[: -self.args.buffer_capacity]  # the oldest are lost
+
+    async def run(self, start, stop_at):
+        args = self.args
+        await asyncio.sleep(random.uniform(0, args.period))  # spread the load
+        while time.monotonic() < stop_at:
+            cycle_start = time.monotonic()
+            self.batch.append(self.read())
+            if is_outage(args, cycle_start - start):
+                self.keep(self.batch)
+                self.batch.clear()
+            else:
+                if len(self.batch) >= args.batch:
+                    readings = self.batch[:]
+                    self.batch.clear()
+                    if not await self.send(readings):
+                        self.keep(readings)
+                # Backfill: the kept readings are sent in a burst
+                while self.backlog and time.monotonic() < stop_at:
+                    readings = self.backlog[: args.backfill_batch]
+                    if not await self.send(readings):
+                        break
+                    del self.backlog[: len(readings)]
+            elapsed = time.monotonic() - cycle_start
+            await asyncio.sleep(max(0, args.period - elapsed))
+        for target, client, encoder in self.uplinks:
+            await client.close()
+
+
+def is_outage(args, elapsed):
+    # The network of every controller goes down for outage_length seconds at
+    # the end of each outage_every seconds, as when the access point fails
+    return bool(args.outage_every) and (
+        elapsed % args.outage_every >= args.outage_every - args.outage_length
+    )
+
+
+async def report(stats, totals, start, stop_at, interval):
+    last = start
+    while time.monotonic() < stop_at:
+        await asyncio.sleep(min(interval, max(0, stop_at - time.monotonic())))
+        now = time.monotonic()
+        for target in stats:
+            current = stats[target]
+            stats[target] = Stats()
+            totals[target].add(current)
+            print(f"[{now - start:6.1f} s] {target}: {current.summary(now - last)}")
+        last = now
+
+
+async def run(args):
+    targets = [target for target in ("http", "influxdb") if getattr(args, target)]
+    if not targets:
+        sys.exit("No server to send the readings to.")
+    stats = {target: Stats() for target in targets}
+    totals = {target: Stats() for target in targets}
+    controllers = [Controller(n, args, stats) for n in range(args.controllers)]
+    print(
+        f"{args.controllers} controllers, one reading every {args.period} s, "
+        f"batches of {args.batch}, during {args.duration} s"
+    )
+    start = time.monotonic()
+    stop_at = start + args.duration
+    await asyncio.gather(
+        report(stats, totals, start, stop_at, args.report_interval),
+        *(controller.run(start, stop_at) for controller in controllers),
+    )
+    elapsed = time.monotonic() - start
+    for target in targets:
+        totals[target].add(stats[target])
+        print(f"Total {target}: {totals[target].summary(elapsed)}")
+    backlog = sum(len(controller.backlog) for controller in controllers)
+    if backlog:
+        print(f"{backlog} readings not sent at the end of the run")
+
+
+class InfluxDBStandIn:
+    """Accepts the writes of the InfluxDB API, and the JSON posts of the HTTP
+    uplink on any other path, and counts the points received."""
+
+    def __init__(self, delay, failure_rate):
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.points = 0
+
+    async def handle(self, reader, writer):
+        # Requests are read one after the other on kept-alive connections
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                if headers.get("content-encoding") == "gzip":
+                    body = gzip.decompress(body)
+                status = self.ingest(path, body)
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                write_response(writer, status)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    def ingest(self, path, body):
+        self.requests += 1
+        if random.random() < self.failure_rate:
+            return 503
+        if path.startswith("/api/v2/write"):
+            self.points += sum(1 for line in body.splitlines() if line.strip())
+            return 204
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+        self.points += len(data) if isinstance(data, list) else 1
+        return 204
+
+    async def serve(self, host, port, interval):
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        print(f"InfluxDB stand-in listening on {host}:{port}")
+        async with server:
+            requests = points = 0
+            while True:
+                await asyncio.sleep(interval)
+                print(
+                    "{:.1f} req/s, {:.1f} points/s".format(
+                        (self.requests - requests) / interval,
+                        (self.points - points) / interval,
+                    )
+                )
+                requests, points = self.requests, self.points
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load generator for the uplink path of the controllers."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("run", help="simulate controllers")
+    load.add_argument("--controllers", type=int, default=100)
+    load.add_argument(
+        "--period",
+        type=float,
+        default=config.DELAY_READING,
+        help="seconds between readings",
+    )
+    load.add_argument("--duration", type=float, default=60, help="seconds")
+    load.add_argument(
+        "--batch",
+        type=int,
+        default=config.UPLINK_BATCH_SIZE,
+        help="readings per request",
+    )
+    load.add_argument(
+        "--backfill-batch",
+        type=int,
+        default=config.BACKFILL_BATCH_SIZE,
+        help="kept readings per request after an outage",
+    )
+    load.add_argument(
+        "--buffer-capacity",
+        type=int,
+        default=config.BUFFER_CAPACITY,
+        help="readings kept per controller during an outage",
+    )
+    load.add_argument(
+        "--outage-every",
+        type=float,
+        default=0,
+        help="seconds between outages, 0 for none",
+    )
+    load.add_argument("--outage-length", type=float, default=0, help="seconds")
+    load.add_argument(
+        "--http",
+        default=f"{config.HTTP_SERVER_URL}:{config.HTTP_SERVER_PORT}/",
+        help="URL of the HTTP server, empty to skip it",
+    )
+    load.add_argument(
+        "--influxdb",
+        default=f"http://{config.INFLUXDB_URL}:{config.INFLUXDB_PORT}",
+        help="URL of InfluxDB, empty to skip it",
+    )
+    load.add_argument("--timeout", type=float, default=config.UPLINK_TIMEOUT)
+    load.add_argument(
+        "--compress",
+        type=int,
+        default=config.UPLINK_COMPRESS_THRESHOLD,
+        help="gzip the payloads of at least this many bytes, 0 to disable",
+    )
+    load.add_argument("--report-interval", type=float, default=10, help="seconds")
+
+    stand_in = commands.add_parser("influxdb", help="run a local InfluxDB stand-in")
+    stand_in.add_argument("--host", default="127.0.0.1")
+    stand_in.add_argument("--port", type=int, default=config.INFLUXDB_PORT)
+    stand_in.add_argument("--delay", type=float, default=0, help="seconds per write")
+    stand_in.add_argument(
+        "--failure-rate", type=float, default=0, help="fraction of writes answered 503"
+    )
+    stand_in.add_argument("--report-interval", type=float, default=10, help="seconds")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "run":
+            asyncio.run(run(args))
+        else:
+            stand_in = InfluxDBStandIn(args.delay, args.failure_rate)
+            asyncio.run(stand_in.serve(args.host, args.port, args.report_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -17,24 +17,68 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import sys, time, json, socket
-import dht
+import sys, time, socket, struct
+from ubinascii import hexlify
+from array import array
 import network
-import urequests as requests
+import uasyncio as asyncio
 
-from machine import Pin, I2C
-from ntptime import settime
-
-import BME280
-import onewire, ds18x20
+from machine import Pin, I2C, RTC, deepsleep, reset_cause, DEEPSLEEP_RESET
 
 import config
+from encoders import JsonEncoder, LineProtocolEncoder
+from http_client import HttpClient, is_rejected
+from ring_buffer import RingBuffer
+import memory
+
+# Load the sensor modules if needed, to speed up the boot
+# ntptime is only loaded when the clock has to be set
+if config.DHT:
+    import dht
+if config.BME280:
+    import BME280
+if config.ONEWIRE:
+    import onewire, ds18x20
 
 # Load the LCD modules if needed
 if config.LCD:
     from lcd_api import LcdApi
     from i2c_lcd import I2cLcd
 
+# Stages timed when PROFILE is enabled. The probes, bme280, http and influxdb
+# stages let the other tasks run while they wait, which is included in them
+if config.PROFILE:
+    from profiler import Profiler
+
+    profiler = Profiler(
+        ("dht", "probes", "bme280", "control", "display", "http", "influxdb"),
+        config.PROFILE_WINDOW,
+    )
+else:
+    profiler = None
+
+# Preallocated BME280 result: temperature (0.01 C), pressure (1/256 Pa), humidity (1/1024 %)
+bme_values = array("i", (0, 0, 0))
+
+# Reading kept in the ring buffer when it cannot be sent: timestamp,
+# temperature (0.01 C), humidity (0.01 %), pressure (0.1 hPa) and pump state
+READING_FORMAT = "<IhhhB"
+NO_VALUE = -32768  # stored instead of "N/A"
+
+# State kept in the RTC memory during deep sleep: magic, pump state and,
+# if there is one, the last reading in the READING_FORMAT
+RTC_STATE_FORMAT = "<4sB"
+RTC_MAGIC = b"SAP1"
+
+# Kept on flash between boots: BSSID of the access point of the last
+# connection, and time of the last clock synchronisation
+NETWORK_CACHE_FORMAT = "<6sI"
+network_cache = [None, 0]
+
+# After a failed clock synchronisation: ticks_ms of the failure, and seconds
+# to wait before the next try, doubling at each failure
+TIME_SYNC_RETRY = 60
+time_sync_backoff = [0, 0]
 
 
 def start_ap(ap):
@@ -44,28 +88,82 @@ def start_ap(ap):
     print(ap.ifconfig())
 
 
-def connect_to_wifi():
+def load_network_cache():
 
-    is_connected = False
-    sta = network.WLAN(network.STA_IF)
-    
-    start = time.ticks_ms()
-    timeout = 10000
-    while not sta.isconnected():
-        if time.ticks_diff(time.ticks_ms(), start) > timeout:
-            print("Timeout")
-            print("Couldn't connect to the network. Check your parameters.")
-            is_connected = False
-            break
-        print("Connecting to network...")
-        sta.active(True)
-        sta.connect(config.WIFI_SSID, config.WIFI_PASSWORD)
-        while (
-            not sta.isconnected() and time.ticks_diff(time.ticks_ms(), start) < timeout
+    try:
+        with open(config.NETWORK_CACHE_FILE, "rb") as f:
+            bssid, synced_at = struct.unpack(NETWORK_CACHE_FORMAT, f.read())
+    except (OSError, ValueError):
+        return
+    network_cache[0] = None if bssid == bytes(6) else bssid
+    network_cache[1] = synced_at
+
+
+def save_network_cache():
+
+    try:
+        with open(config.NETWORK_CACHE_FILE, "wb") as f:
+            bssid = network_cache[0] or bytes(6)  # not known yet
+            f.write(struct.pack(NETWORK_CACHE_FORMAT, bssid, network_cache[1]))
+    except OSError as e:
+        print("Could not save the network cache:", e)
+
+
+def scan_bssid(sta):
+    # Slow path: look for the strongest access point of the network
+
+    # The SSIDs are compared as bytes, those of other networks may not be
+    # valid UTF-8
+    ssid_wanted = config.WIFI_SSID.encode()
+    best_bssid = None
+    best_rssi = None
+    for ssid, bssid, channel, rssi, authmode, hidden in sta.scan():
+        if ssid == ssid_wanted and (
+            best_rssi is None or rssi > best_rssi
         ):
-            print("Connecting")
-            time.sleep_ms(500)
+            best_bssid = bssid
+            best_rssi = rssi
+    return best_bssid
+
+
+async def wait_for_wifi(sta, bssid, timeout):
+
+    print("Connecting to network...")
+    if bssid is None:
+        sta.connect(config.WIFI_SSID, config.WIFI_PASSWORD)
     else:
+        sta.connect(config.WIFI_SSID, config.WIFI_PASSWORD, bssid=bssid)
+    start = time.ticks_ms()
+    while not sta.isconnected() and time.ticks_diff(time.ticks_ms(), start) < timeout:
+        print("Connecting")
+        await asyncio.sleep_ms(100)
+    return sta.isconnected()
+
+
+async def connect_to_wifi():
+    # The access point of the last connection is tried first, without
+    # scanning. If it cannot be reached, the network is scanned for the
+    # strongest access point, which is kept for the next boot
+    # Only the scan blocks the other tasks, the connection is waited for
+
+    sta = network.WLAN(network.STA_IF)
+    sta.active(True)
+    load_network_cache()
+
+    # The ESP8266 may already have reconnected by itself
+    is_connected = sta.isconnected()
+    if not is_connected and network_cache[0] is not None:
+        is_connected = await wait_for_wifi(
+            sta, network_cache[0], config.WIFI_FAST_TIMEOUT
+        )
+    if not is_connected:
+        bssid = scan_bssid(sta)
+        is_connected = await wait_for_wifi(sta, bssid, 10000)
+        if is_connected and bssid is not None and bssid != network_cache[0]:
+            network_cache[0] = bssid
+            save_network_cache()
+
+    if is_connected:
         print("Connected!")
         print("Network configuration:", sta.ifconfig())
         a = sta.config("mac")
@@ -74,46 +172,123 @@ def connect_to_wifi():
                 a[0], a[1], a[2], a[3], a[4]
             )
         )
-        is_connected = True
-        settime()
+    else:
+        print("Timeout")
+        print("Couldn't connect to the network. Check your parameters.")
 
     return is_connected
 
 
-def get_env_data(i2c):
-    # Measure the environmental data
-    # The temperature is calibrated with a factor
+def sync_time():
+    # The clock is only set when it was lost (after a power loss, it restarts
+    # in 2000) or when it was last set more than TIME_SYNC_INTERVAL ago
+    # settime() blocks the other tasks, so a failure is only retried after
+    # a delay, doubling up to TIME_SYNC_INTERVAL
+    # Returns the seconds by which the clock moved if it was lost, for the
+    # readings taken meanwhile to be corrected, else 0
+
+    now = time.time()
+    was_lost = time.localtime(now)[0] < 2023
+    if not was_lost and now - network_cache[1] < config.TIME_SYNC_INTERVAL:
+        return 0
+    if time_sync_backoff[1] and (
+        time.ticks_diff(time.ticks_ms(), time_sync_backoff[0])
+        < time_sync_backoff[1] * 1000
+    ):
+        return 0
+    from ntptime import settime
+
+    try:
+        settime()
+    except Exception as e:
+        print("Could not set the clock:", e)
+        time_sync_backoff[0] = time.ticks_ms()
+        time_sync_backoff[1] = min(
+            max(2 * time_sync_backoff[1], TIME_SYNC_RETRY), config.TIME_SYNC_INTERVAL
+        )
+        return 0
+    time_sync_backoff[1] = 0
+    network_cache[1] = time.time()
+    save_network_cache()
+    return network_cache[1] - now if was_lost else 0
+
+
+async def read_bme280(bme_sensor):
+    # Trigger a conversion and let the other tasks run until it is completed,
+    # the driver telling how long to wait (polling the status register with
+    # BME280_POLL_STATUS)
+
+    timeout_us = bme_sensor.start_measurement()
+    start = time.ticks_us()
+    while True:
+        wait_ms = bme_sensor.pending_ms(start, timeout_us)
+        if not wait_ms:
+            break
+        await asyncio.sleep_ms(wait_ms)
+    bme_sensor.read_compensated(bme_values, trigger=False)
+
 
-    timestamp = (
+def get_timestamp():
+
+    return (
         round(time.time()) + 946684761
     )  # time difference with the microcontroller
 
+
+async def read_probes(hardware):
+    # All the DS18B20 probes convert at once, so the bus is read after a
+    # single conversion time whatever the number of probes
+    # Each probe is reported as its own field, named after its ROM ID
+
+    onewire_sensor = hardware.onewire_sensor
+    onewire_sensor.convert_temp()
+    await asyncio.sleep_ms(hardware.onewire_conversion_ms)
+    temperatures = {}
+    for rom, name in hardware.probes:
+        try:
+            temperatures[name] = onewire_sensor.read_temp(rom)
+        except Exception as e:
+            print(f"Could not read the 1-wire probe {name}:", e)
+            temperatures[name] = "N/A"
+    return temperatures
+
+
+async def get_env_data(hardware):
+    # Measure the environmental data
+    # The temperature is calibrated with a factor
+
+    timestamp = get_timestamp()
+
     if config.DHT:
-        dht_sensor = dht.DHT22(Pin(config.DHT_PIN))
+        if profiler:
+            profiler.start("dht")
+        dht_sensor = hardware.dht_sensor
         dht_sensor.measure()
         cal_factor = config.TEMPCAL_FACTOR
         temperature = dht_sensor.temperature() + cal_factor
         humidity = dht_sensor.humidity()
+        if profiler:
+            profiler.stop("dht")
     else:
         temperature = "N/A"
         humidity = "N/A"
     
-    # Future feature: using a DS18B20 temperature sensor
     if config.ONEWIRE:
-        print("Using OneWire sensor")
-        onewire_sensor = ds18x20.DS18X20(onewire.OneWire(config.ONEWIRE_PIN))
-        onewire_devices = onewire.scan()
-        onewire_sensor.convert_temp()
-        time.sleep_ms(750)
-        temperature_onewire = onewire_sensor.read_temp(onewire_devices[0])
-        print(f"There are {len(onewire_devices)} 1-wire temperature probes")
-        print(f"The temperature measured by the first one on the bus is {temperature_onewire}°C")
+        if profiler:
+            profiler.start("probes")
+        temperature_probes = await read_probes(hardware)
+        if profiler:
+            profiler.stop("probes")
     else:
-        temperature_onewire = "N/A"
-    
+        temperature_probes = {}
+
     if config.BME280:
-        bme_sensor = BME280.BME280(i2c=i2c, address=int(config.BME280_ADDRESS))
-        pressure = round(float(bme_sensor.pressure[:-3]))
+        if profiler:
+            profiler.start("bme280")
+        await read_bme280(hardware.bme_sensor)
+        pressure = (bme_values[1] + 12800) // 25600  # from 1/256 Pa to hPa
+        if profiler:
+            profiler.stop("bme280")
     else:
         pressure = "N/A"
     
@@ -123,79 +298,182 @@ def get_env_data(i2c):
         "pressure": pressure,
         "timestamp": timestamp,
     }
+    env_data.update(temperature_probes)
     print(f"Environmental data measured: {env_data}")
 
     return env_data
 
 
-def control_vacuum_pump(env_data):
-    # This function will also control the different solenoid valves
+def set_relay(hardware, start_vacuum_pump):
+    # The relay uses the normally open configuration: a low pin starts the pump
+
+    hardware.relay.value(0 if start_vacuum_pump else 1)
 
-    relay = Pin(config.RELAY_PIN, Pin.OUT)
+
+def control_vacuum_pump(hardware, env_data, start_vacuum_pump):
+    # This function will also control the different solenoid valves
+    # Between the two setpoints, the last state of the pump is kept
 
     if env_data["temperature"] >= config.START_TEMP:
         start_vacuum_pump = True
-        relay.value(0)  # use the normally open configuration
     elif env_data["temperature"] <= config.STOP_TEMP:
         start_vacuum_pump = False
-        relay.value(1)  # stops the pump
     else:
         pass  # keep the last state
+    # The relay is always set, as it may not match the state kept, e.g. after
+    # a deep sleep reset, which sets the pins low
+    set_relay(hardware, start_vacuum_pump)
 
     print(f"Can the pump be started? {start_vacuum_pump}")
 
     return start_vacuum_pump
 
 
-def send_data_to_http(env_data, start_vacuum_pump):
+def to_fixed(value, scale):
+    return NO_VALUE if value == "N/A" else round(value * scale)
 
-    env_data["pump"] = start_vacuum_pump
-    env_data_json = json.dumps(env_data)
-    print(env_data_json)
-    headers = {
-        "Content-Type": "text/plain; charset=utf-8",
-        "Accept": "application/json",
-    }
-    try:
-        requests.post(
-            url=f"{config.HTTP_SERVER_URL}:{config.HTTP_SERVER_PORT}",
-            json=env_data_json,
-            headers=headers,
-        )
-        print("Data written to HTTP server.")
-    except:
-        print("Could not make a POST request")
 
+def from_fixed(value, scale):
+    return "N/A" if value == NO_VALUE else value / scale
 
-def send_data_to_influxdb(env_data, start_vacuum_pump):
 
-    line_protocol_data = f"{config.ORGANIZATION},sensor_id={config.SENSOR_ID} temperature={env_data['temperature']},humidity={env_data['humidity']},pressure={env_data['pressure']},pump_started={start_vacuum_pump} {env_data['timestamp']}"
-    print(line_protocol_data)
+def pack_reading(env_data):
+    # Compact binary record of a reading, for the ring buffer
 
-    baseurl = f"http://{config.INFLUXDB_URL}:{config.INFLUXDB_PORT}"
-    precision = "s"
-    write_url = (
-        baseurl
-        + f"/api/v2/write?org={config.ORGANIZATION}&bucket={config.BUCKET}&precision={precision}"
+    return struct.pack(
+        READING_FORMAT,
+        env_data["timestamp"],
+        to_fixed(env_data["temperature"], 100),
+        to_fixed(env_data["humidity"], 100),
+        to_fixed(env_data["pressure"], 10),
+        env_data["pump"],
     )
-    headers = {
-        "Authorization": f"Token {config.INFLUXDB_TOKEN}",
-        "Content-Type": "text/plain; charset=utf-8",
-        "Accept": "application/json",
+
+
+def unpack_reading(record):
+
+    timestamp, temperature, humidity, pressure, pump = struct.unpack(
+        READING_FORMAT, record
+    )
+    return {
+        "temperature": from_fixed(temperature, 100),
+        "humidity": from_fixed(humidity, 100),
+        "pressure": from_fixed(pressure, 10),
+        "timestamp": timestamp,
+        "pump": bool(pump),
     }
 
+
+def is_delivered(server, status_code):
+    # Data that would be rejected again is dropped, otherwise it is kept for
+    # a retry
+
+    if status_code < 300:
+        print(f"Data written to {server}.")
+        return True
+    if is_rejected(status_code):
+        print(f"Data rejected by {server} (HTTP {status_code}), dropping it.")
+        return True
+    print(f"Could not write to {server} (HTTP {status_code}).")
+    return False
+
+
+async def send_data_to_http(uplink, readings):
+    # A single reading is sent as a JSON object, several as a JSON array
+
+    client, encoder = uplink
+    payload = encoder.encode(readings)
+    print(f"Sending {len(readings)} readings ({len(payload)} bytes) to the HTTP server.")
     try:
-        requests.post(write_url, headers=headers, data=line_protocol_data)
-        print("Data written to InfluxDB.")
-    except:
-        print("Could not connect or write to InfluxDB.")
+        status_code = await client.post(payload)
+    except Exception as e:
+        print("Could not make a POST request:", e)
+        return False
+    return is_delivered("HTTP server", status_code)
+
+
+async def send_data_to_influxdb(uplink, readings):
+
+    client, encoder = uplink
+    payload = encoder.encode(readings)
+    print(f"Sending {len(readings)} readings ({len(payload)} bytes) to InfluxDB.")
+    try:
+        status_code = await client.post(payload)
+    except Exception as e:
+        print("Could not connect or write to InfluxDB:", e)
+        return False
+    return is_delivered("InfluxDB", status_code)
+
+
+def create_uplinks():
+    # One kept-alive connection and one encoder per configured server, the
+    # static parts of the requests being encoded once here
+
+    batch_size = max(config.UPLINK_BATCH_SIZE, config.BACKFILL_BATCH_SIZE)
+    uplinks = {}
+    if config.SEND_DATA_HTTP:
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "X-Sensor-Id": config.SENSOR_ID,
+        }
+        client = HttpClient(
+            config.HTTP_SERVER_URL.split("://")[-1],
+            config.HTTP_SERVER_PORT,
+            "/",
+            headers,
+            config.UPLINK_TIMEOUT,
+            config.UPLINK_COMPRESS_THRESHOLD,
+        )
+        uplinks["http"] = (client, JsonEncoder(128 * batch_size))
+    if config.SEND_DATA_INFLUXDB:
+        precision = "s"
+        write_path = f"/api/v2/write?org={config.ORGANIZATION}&bucket={config.BUCKET}&precision={precision}"
+        headers = {
+            "Authorization": f"Token {config.INFLUXDB_TOKEN}",
+            "Content-Type": "text/plain; charset=utf-8",
+            "Accept": "application/json",
+        }
+        client = HttpClient(
+            config.INFLUXDB_URL,
+            config.INFLUXDB_PORT,
+            write_path,
+            headers,
+            config.UPLINK_TIMEOUT,
+            config.UPLINK_COMPRESS_THRESHOLD,
+        )
+        encoder = LineProtocolEncoder(
+            config.ORGANIZATION, {"sensor_id": config.SENSOR_ID}, 128 * batch_size
+        )
+        uplinks["influxdb"] = (client, encoder)
+    return uplinks
+
+
+async def send_readings(uplinks, readings):
+    # Returns True once every configured server has the readings
+
+    delivered = True
+    if "http" in uplinks:
+        if profiler:
+            profiler.start("http")
+        delivered = await send_data_to_http(uplinks["http"], readings) and delivered
+        if profiler:
+            profiler.stop("http")
+    if "influxdb" in uplinks:
+        if profiler:
+            profiler.start("influxdb")
+        delivered = (
+            await send_data_to_influxdb(uplinks["influxdb"], readings) and delivered
+        )
+        if profiler:
+            profiler.stop("influxdb")
+    return delivered
 
 
 def display_data(is_connected, env_data, start_vacuum_pump, lcd):
     # Print the environmental data to the LCD display
-    
-    lcd.clear()
-    lcd.hide_cursor()
+    # Only the characters that changed since the last refresh are written
+
     if config.LANGUAGE == "FR":
         if start_vacuum_pump:
             start_vacuum_pump_fr = "oui"
@@ -205,7 +483,7 @@ def display_data(is_connected, env_data, start_vacuum_pump, lcd):
             is_connected_fr = "oui"
         else:
             is_connected_fr = "non"
-        lcd.putstr(
+        lcd.update(
             "Temp: {} C\nHumidite: {} %\nPression: {} hPa\nPompe? {} WF {}".format(
                 env_data["temperature"],
                 env_data["humidity"],
@@ -215,7 +493,7 @@ def display_data(is_connected, env_data, start_vacuum_pump, lcd):
             )
         )
     else:
-        lcd.putstr(
+        lcd.update(
             "Temp: {}C\nHumidity: {}%\nPressure: {}hPa\nPump? {} WF {}".format(
                 env_data["temperature"],
                 env_data["humidity"],
@@ -226,46 +504,345 @@ def display_data(is_connected, env_data, start_vacuum_pump, lcd):
         )
 
 
-def show_error():
+async def show_error(hardware):
     # The LED from the ESP8266 will flash upon error
 
-    led = Pin(config.LED_PIN, Pin.OUT)
+    led = hardware.led
     for i in range(5):
         led.off()
-        time.sleep(0.5)
+        await asyncio.sleep(0.5)
         led.on()
-        time.sleep(0.5)
+        await asyncio.sleep(0.5)
     led.on()
 
 
-def run(i2c, lcd, is_connected):
+async def sleep_until_next(start, period):
+    # Sleep for the rest of the period (in seconds) started at start (in ms)
 
-    try:
-        env_data = get_env_data(i2c)
-        start_vacuum_pump = control_vacuum_pump(env_data)
+    elapsed = time.ticks_diff(time.ticks_ms(), start)
+    await asyncio.sleep_ms(max(0, period * 1000 - elapsed))
 
-        if lcd is not None:
-            display_data(is_connected, env_data, start_vacuum_pump, lcd)
-        else:
-            pass
 
+async def sense_and_control(hardware, state):
+    # Measure and drive the pump, independently of the display and the uplink
+
+    while True:
+        start = time.ticks_ms()
+        try:
+            env_data = await get_env_data(hardware)
+            if profiler:
+                profiler.start("control")
+            state["start_vacuum_pump"] = control_vacuum_pump(
+                hardware, env_data, state["start_vacuum_pump"]
+            )
+            if profiler:
+                profiler.stop("control")
+                # The statistics are sent with one reading in PROFILE_WINDOW
+                if profiler.add_fields(env_data):
+                    profiler.print_report()
+            env_data["pump"] = state["start_vacuum_pump"]
+            state["env_data"] = env_data
+            # Idle until the next reading: the garbage of this one is
+            # collected now rather than during the next one
+            memory.collect()
+            if config.MEMORY_TELEMETRY:
+                memory.add_fields(env_data)
+                memory.print_report()
+            if config.SEND_DATA_HTTP or config.SEND_DATA_INFLUXDB:
+                state["batch"].append(env_data)
+        except Exception as e:
+            print("Error while measuring or controlling the pump:", e)
+            await show_error(hardware)
+        print(f"Waiting {config.DELAY_READING} seconds before the next reading.")
+        await sleep_until_next(start, config.DELAY_READING)
+
+
+async def refresh_display(lcd, state):
+
+    while True:
+        start = time.ticks_ms()
+        if state["env_data"] is not None:
+            try:
+                if profiler:
+                    profiler.start("display")
+                display_data(
+                    state["is_connected"],
+                    state["env_data"],
+                    state["start_vacuum_pump"],
+                    lcd,
+                )
+                if profiler:
+                    profiler.stop("display")
+            except Exception as e:
+                print("Error while refreshing the display:", e)
+        await sleep_until_next(start, config.DELAY_DISPLAY)
+
+
+def is_wifi_connected():
+
+    return config.CONNECT_WIFI and network.WLAN(network.STA_IF).isconnected()
+
+
+async def backfill(uplinks, buffer):
+    # Send the readings kept while the network or the servers were down, in
+    # batches, oldest first
+
+    while len(buffer):
+        records = buffer.peek(config.BACKFILL_BATCH_SIZE)
+        readings = [unpack_reading(record) for record in records]
+        if not await send_readings(uplinks, readings):
+            break
+        buffer.drop(len(records))
+        print(f"{len(records)} buffered readings sent, {len(buffer)} left.")
+        memory.collect()  # the readings and the payloads of the batch
+        await asyncio.sleep(0)
+
+
+def keep_readings(buffer, readings):
+
+    for env_data in readings:
+        buffer.append(pack_reading(env_data))
+    print(f"{len(readings)} readings kept in the buffer until they can be sent.")
+
+
+async def uplink(state, uplinks, buffer):
+    # Send the readings in batches of UPLINK_BATCH_SIZE readings, or of
+    # UPLINK_BATCH_INTERVAL seconds, in one request per server. A slow
+    # network only delays this task, the POST requests yielding to the other
+    # tasks and being bounded by UPLINK_TIMEOUT. Readings that cannot be sent
+    # are kept in the ring buffer until the connection comes back.
+
+    batch = state["batch"]
+    # The readings are kept in the batch until the network was tried, the
+    # clock may be set then
+    while state["is_connected"] is None:
+        await asyncio.sleep_ms(100)
+    while True:
+        start = time.ticks_ms()
+        is_connected = is_wifi_connected()
+        if batch and not is_connected:
+            print("Not connected to the wireless network.")
+            keep_readings(buffer, batch)
+            batch.clear()
+        elif batch and (
+            len(batch) >= config.UPLINK_BATCH_SIZE
+            or get_timestamp() - batch[0]["timestamp"] >= config.UPLINK_BATCH_INTERVAL
+        ):
+            readings = batch[:]  # new readings may come in while sending
+            batch.clear()
+            if not await send_readings(uplinks, readings):
+                keep_readings(buffer, readings)
+            readings = None
+            memory.collect()
+            if config.MEMORY_TELEMETRY:
+                # Once per batch, out of the sensing task
+                memory.sample_largest_block()
         if is_connected:
-            if config.SEND_DATA_HTTP:
-                send_data_to_http(env_data, start_vacuum_pump)
-            if config.SEND_DATA_INFLUXDB:
-                send_data_to_influxdb(env_data, start_vacuum_pump)
+            await backfill(uplinks, buffer)
+        await sleep_until_next(start, config.DELAY_UPLINK)
+
+
+async def join_network(state):
+    # The network is joined once the first pump decision is taken (or after
+    # DELAY_READING if the sensors fail), the scan blocking the other tasks,
+    # then joined again whenever it is lost, waiting longer after each
+    # failure. The clock is set once connected, and the readings not sent
+    # yet are corrected if it was lost
+
+    start = time.ticks_ms()
+    while (
+        state["env_data"] is None
+        and time.ticks_diff(time.ticks_ms(), start) < config.DELAY_READING * 1000
+    ):
+        await asyncio.sleep_ms(100)
+    retry_delay = config.DELAY_UPLINK
+    while True:
+        start = time.ticks_ms()
+        if is_wifi_connected():
+            state["is_connected"] = True
+            retry_delay = config.DELAY_UPLINK
         else:
-            print(
-                "Not connected to the wireless network. Not sending data to a server at the moment."
+            state["is_connected"] = await connect_to_wifi()
+            if not state["is_connected"]:
+                retry_delay = min(2 * retry_delay, 16 * config.DELAY_UPLINK)
+        if state["is_connected"]:
+            correction = sync_time()
+            for env_data in state["batch"]:
+                env_data["timestamp"] += correction
+        await sleep_until_next(start, retry_delay)
+
+
+def woke_from_deepsleep():
+
+    return config.DEEPSLEEP and reset_cause() == DEEPSLEEP_RESET
+
+
+def save_state(state):
+    # The RTC memory keeps its content during deep sleep, but not on power loss
+
+    record = struct.pack(RTC_STATE_FORMAT, RTC_MAGIC, state["start_vacuum_pump"])
+    if state["env_data"] is not None:
+        record += pack_reading(state["env_data"])
+    RTC().memory(record)
+
+
+def load_state(state):
+
+    record = RTC().memory()
+    size = struct.calcsize(RTC_STATE_FORMAT)
+    if len(record) < size:
+        return
+    magic, start_vacuum_pump = struct.unpack(RTC_STATE_FORMAT, record[:size])
+    if magic != RTC_MAGIC:
+        return
+    state["start_vacuum_pump"] = bool(start_vacuum_pump)
+    if len(record) == size + struct.calcsize(READING_FORMAT):
+        state["env_data"] = unpack_reading(record[size:])
+
+
+async def sense_and_sleep(hardware, state):
+    # Deep sleep mode: one reading per boot, after which the whole board
+    # sleeps until the next one. The pump state and the last reading are
+    # kept in the RTC memory, and the readings are stored in the ring buffer
+    # until UPLINK_BATCH_SIZE of them, or UPLINK_BATCH_INTERVAL seconds of
+    # them, can be sent together. The network is only joined to send them.
+    # The ring buffer only keeps the main values of the readings, so only
+    # the readings of the wakes that send are sent with all their fields
+
+    # The period is counted from the boot when waking, ticks_ms starting from
+    # 0, and from now after a power-on, the boot having taken longer
+    start = 0 if woke_from_deepsleep() else time.ticks_ms()
+    if woke_from_deepsleep():
+        load_state(state)
+    # The pins are low after the reset, which starts the pump whatever the
+    # state kept, until the reading is done
+    set_relay(hardware, state["start_vacuum_pump"])
+    env_data = None
+    try:
+        env_data = await get_env_data(hardware)
+        state["start_vacuum_pump"] = control_vacuum_pump(
+            hardware, env_data, state["start_vacuum_pump"]
+        )
+        env_data["pump"] = state["start_vacuum_pump"]
+        state["env_data"] = env_data
+    except Exception as e:
+        print("Error while measuring or controlling the pump:", e)
+        await show_error(hardware)
+
+    if config.CONNECT_WIFI and not woke_from_deepsleep():
+        # After a power-on, the network is joined to set the clock
+        state["is_connected"] = await connect_to_wifi()
+        if state["is_connected"]:
+            correction = sync_time()
+            if env_data is not None:
+                env_data["timestamp"] += correction
+
+    if hardware.lcd is not None and state["env_data"] is not None:
+        try:
+            display_data(
+                state["is_connected"],
+                state["env_data"],
+                state["start_vacuum_pump"],
+                hardware.lcd,
             )
+        except Exception as e:
+            print("Error while refreshing the display:", e)
 
-    except:
-        show_error()
+    if env_data is not None and (config.SEND_DATA_HTTP or config.SEND_DATA_INFLUXDB):
+        buffer = RingBuffer(
+            config.BUFFER_FILE, struct.calcsize(READING_FORMAT), config.BUFFER_CAPACITY
+        )
+        oldest = unpack_reading(buffer.peek(1)[0]) if len(buffer) else env_data
+        sent = False
+        if config.CONNECT_WIFI and (
+            len(buffer) + 1 >= config.UPLINK_BATCH_SIZE
+            or get_timestamp() - oldest["timestamp"] >= config.UPLINK_BATCH_INTERVAL
+        ):
+            state["is_connected"] = is_wifi_connected() or await connect_to_wifi()
+            if state["is_connected"]:
+                sync_time()
+                uplinks = create_uplinks()
+                await backfill(uplinks, buffer)
+                # After the older readings, to keep them in order
+                sent = not len(buffer) and await send_readings(uplinks, [env_data])
+        if not sent:
+            buffer.append(pack_reading(env_data))
+
+    save_state(state)
+    # A wake longer than the period is followed by the shortest sleep, as
+    # deepsleep(0) would sleep without a wake timer, i.e. forever
+    print(f"Sleeping until the next reading, in {config.DELAY_READING} seconds.")
+    elapsed = time.ticks_diff(time.ticks_ms(), start)
+    deepsleep(max(1, config.DELAY_READING * 1000 - elapsed))
+
+
+async def run(hardware):
+    # Sensing and control, display, network and uplink run as separate tasks,
+    # each with its own period
+
+    state = {
+        "env_data": None,
+        "start_vacuum_pump": False,
+        "is_connected": False,
+        "batch": [],  # readings waiting to be sent
+    }
+    if config.DEEPSLEEP:
+        await sense_and_sleep(hardware, state)
+        return
+    if config.CONNECT_WIFI:
+        state["is_connected"] = None  # not tried yet
+        asyncio.create_task(join_network(state))
+    if hardware.lcd is not None:
+        asyncio.create_task(refresh_display(hardware.lcd, state))
+    if config.SEND_DATA_HTTP or config.SEND_DATA_INFLUXDB:
+        buffer = RingBuffer(
+            config.BUFFER_FILE, struct.calcsize(READING_FORMAT), config.BUFFER_CAPACITY
+        )
+        asyncio.create_task(uplink(state, create_uplinks(), buffer))
+    await sense_and_control(hardware, state)
+
+
+class Hardware:
+    # Handles of the sensors and actuators, created once by initialize() and
+    # shared by the tasks, so that nothing is rebuilt at each reading
+
+    def __init__(self):
+        self.i2c = I2C(scl=Pin(config.SCL_PIN), sda=Pin(config.SDA_PIN), freq=10000)
+        self.relay = Pin(config.RELAY_PIN, Pin.OUT)
+        self.led = Pin(config.LED_PIN, Pin.OUT)
+        self.dht_sensor = None
+        self.bme_sensor = None
+        self.onewire_sensor = None
+        self.probes = []  # ROM ID and field name of each 1-wire probe
+        self.onewire_conversion_ms = 750
+        self.lcd = None
+
+
+def set_probes_resolution(onewire_sensor, roms):
+    # Set the resolution of the DS18B20 (and DS1822) probes and return the
+    # conversion time in ms, from 94 ms at 9 bits to 750 ms at 12 bits
+    # The DS18S20 has a fixed resolution and always takes 750 ms
+
+    bits = config.ONEWIRE_RESOLUTION
+    if not 9 <= bits <= 12:
+        raise ValueError(f"Unexpected ONEWIRE_RESOLUTION value {bits}.")
+    shift = 12 - bits
+    conversion_ms = (750 + (1 << shift) - 1) >> shift
+    for rom, name in roms:
+        if rom[0] == 0x10:
+            conversion_ms = 750
+            continue
+        scratch = onewire_sensor.read_scratch(rom)
+        # Alarm registers (TH and TL) are kept, only the configuration changes
+        onewire_sensor.write_scratch(
+            rom, bytearray((scratch[2], scratch[3], (bits - 9) << 5 | 0x1F))
+        )
+    return conversion_ms
 
 
 def initialize():
 
-    i2c = I2C(scl=Pin(config.SCL_PIN), sda=Pin(config.SDA_PIN), freq=10000)
+    hardware = Hardware()
     ap = network.WLAN(network.AP_IF)  # create access-point interface
 
     if config.ACTIVATE_AP:
@@ -275,31 +852,59 @@ def initialize():
         ap.active(False)  # deactivate the interface
         print("Access point deactivated.")
 
+    if config.DHT:
+        hardware.dht_sensor = dht.DHT22(Pin(config.DHT_PIN))
+
+    if config.BME280:
+        bme_sensor = BME280.BME280(
+            i2c=hardware.i2c,
+            address=int(config.BME280_ADDRESS),
+            cache_calibration=config.BME280_CACHE_CALIBRATION,
+            poll_status=config.BME280_POLL_STATUS,
+        )
+        if config.BME280_NORMAL_MODE:
+            bme_sensor.configure(
+                power_mode=BME280.BME280_NORMAL_MODE,
+                standby=config.BME280_STANDBY,
+                iir_filter=config.BME280_IIR_FILTER,
+            )
+        hardware.bme_sensor = bme_sensor
+
+    if config.ONEWIRE:
+        # The probes are looked for once, at startup
+        onewire_sensor = ds18x20.DS18X20(onewire.OneWire(Pin(config.ONEWIRE_PIN)))
+        hardware.probes = [
+            (rom, "probe_" + hexlify(rom).decode()) for rom in onewire_sensor.scan()
+        ]
+        print(f"There are {len(hardware.probes)} 1-wire temperature probes")
+        hardware.onewire_conversion_ms = set_probes_resolution(
+            onewire_sensor, hardware.probes
+        )
+        hardware.onewire_sensor = onewire_sensor
+
     if config.LCD:
-        lcd = I2cLcd(i2c, int(config.LCD_ADDRESS), config.LCD_TOTALROWS, config.LCD_TOTALCOLUMNS)
+        lcd = I2cLcd(hardware.i2c, int(config.LCD_ADDRESS), config.LCD_TOTALROWS, config.LCD_TOTALCOLUMNS)
         lcd.clear()
         lcd.hide_cursor()
         lcd.backlight_off()
-        if config.LANGUAGE == "FR":
-            lcd.putstr("Bienvenue!\nSysteme vacuum Norm\n{}\n".format(config.CURRENT_VERSION)
-        )
-        else:
-            lcd.putstr("Welcome!\nVacuum system Norm\n{}".format(config.CURRENT_VERSION))
-        time.sleep(3)
+        if not woke_from_deepsleep():  # resume quickly from deep sleep
+            if config.LANGUAGE == "FR":
+                lcd.putstr(
+                    "Bienvenue!\nSysteme vacuum Norm\n{}\n".format(config.CURRENT_VERSION)
+                )
+            else:
+                lcd.putstr("Welcome!\nVacuum system Norm\n{}".format(config.CURRENT_VERSION))
+        hardware.lcd = lcd
     else:
         print("No LCD configured. Data will not be displayed on a screen.")
-        lcd = None    
 
-    if config.CONNECT_WIFI:
-        is_connected = connect_to_wifi()
-    else:
-        is_connected = False
+    # The threshold is set once the hardware objects are allocated
+    memory.set_threshold(config.GC_THRESHOLD)
 
-    return i2c, lcd, is_connected
+    return hardware
 
 
-i2c, lcd, is_connected = initialize()
-while True:
-    run(i2c, lcd, is_connected)
-    print(f"Waiting {config.DELAY_READING} seconds before the next reading.")
-    time.sleep(config.DELAY_READING)
\ No newline at end of file
+if __name__ == "__main__":
+    # The network is joined by the tasks, after the first pump decision
+    hardware = initialize()
+    asyncio.run(run(hardware))
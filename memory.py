@@ -0,0 +1,93 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Heap management: garbage collections at the idle points of the loop,
+automatic collection threshold and heap telemetry."""
+
+import gc
+import time
+
+# Only the collections made at idle points by collect() are counted, not
+# the automatic ones
+collection_count = 0
+collection_us = 0  # total time they took
+largest_block = None  # last measured by sample_largest_block()
+
+
+def set_threshold(percent):
+    """Makes MicroPython collect the garbage once percent of the currently
+    free heap has been allocated, before the heap runs out and while the
+    collection is short. 0 leaves the collection to when an allocation fails."""
+    gc.collect()
+    if percent:
+        gc.threshold(gc.mem_free() * percent // 100)
+
+
+def collect():
+    """Collects the garbage now, at a point of the loop where nothing waits
+    for it, rather than during a reading or an I2C transfer."""
+    global collection_count, collection_us
+    start = time.ticks_us()
+    gc.collect()
+    collection_us += time.ticks_diff(time.ticks_us(), start)
+    collection_count += 1
+
+
+def largest_free_block(resolution=64):
+    """Returns the size of the largest block that can be allocated, within
+    resolution bytes, by trying allocations between 0 and the free heap. The
+    heap is collected after each try, so this takes a few collections."""
+    low = 0
+    high = gc.mem_free()
+    while high - low > resolution:
+        size = (low + high) // 2
+        try:
+            block = bytearray(size)
+        except MemoryError:
+            high = size
+        else:
+            block = None
+            low = size
+        gc.collect()
+    return low
+
+
+def sample_largest_block():
+    """Measures the largest free block, to be called at an idle point, as
+    it takes a few near heap-sized allocations and collections."""
+    global largest_block
+    largest_block = largest_free_block()
+
+
+def add_fields(env_data):
+    """Adds the free heap, its largest free block as last sampled and the
+    number and time of the idle collections to a reading."""
+    env_data["mem_free"] = gc.mem_free()
+    if largest_block is not None:
+        env_data["mem_largest_block"] = largest_block
+    env_data["gc_idle_collections"] = collection_count
+    env_data["gc_idle_collection_us"] = collection_us
+
+
+def print_report():
+    print(
+        f"Free heap: {gc.mem_free()} bytes, largest block: "
+        f"{'?' if largest_block is None else largest_block} bytes, "
+        f"{collection_count} idle collections ({collection_us} us)."
+    )
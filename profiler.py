@@ -0,0 +1,126 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Duration and heap use of the stages of a reading cycle."""
+
+import gc
+import time
+from array import array
+
+
+class Profiler:
+    """Times stages with ticks_us, and measures the heap they use with
+    gc.mem_free (negative when a collection happened meanwhile). The last
+    window runs of each stage are kept in preallocated arrays, so that
+    profiling does not allocate, and are summed up as minimum, average and
+    maximum.
+
+    A stage is measured between start(stage) and stop(stage). A stage cannot
+    be started again before it is stopped. A stage that awaits between the
+    two is measured in wall time: its duration and heap use include those of
+    the tasks that ran meanwhile.
+    """
+
+    def __init__(self, stages, window=16):
+        self.stages = stages
+        self.window = window
+        self._index = {}
+        self._names = []  # field names of the statistics of each stage
+        for i, stage in enumerate(stages):
+            self._index[stage] = i
+            self._names.append(
+                tuple(
+                    "prof_{}_{}".format(stage, name)
+                    for name in ("us_min", "us_avg", "us_max", "mem_max")
+                )
+            )
+        size = window * len(stages)
+        self._durations = array("i", [0] * size)
+        self._memory = array("i", [0] * size)
+        self._started = array("i", [0] * len(stages))
+        self._free = array("i", [0] * len(stages))
+        self._next = array("H", [0] * len(stages))
+        self._count = array("H", [0] * len(stages))
+        self._calls = 0  # of add_fields
+
+    def start(self, stage):
+        i = self._index[stage]
+        self._free[i] = gc.mem_free()
+        self._started[i] = time.ticks_us()
+
+    def stop(self, stage):
+        i = self._index[stage]
+        duration = time.ticks_diff(time.ticks_us(), self._started[i])
+        slot = i * self.window + self._next[i]
+        self._durations[slot] = duration
+        self._memory[slot] = self._free[i] - gc.mem_free()
+        self._next[i] = (self._next[i] + 1) % self.window
+        if self._count[i] < self.window:
+            self._count[i] += 1
+
+    def summary(self, stage):
+        """Returns the number of runs kept for stage, the minimum, average
+        and maximum of their durations (µs) and the most heap one used."""
+        i = self._index[stage]
+        count = self._count[i]
+        if not count:
+            return 0, 0, 0, 0, 0
+        first = i * self.window
+        shortest = longest = self._durations[first]
+        total = 0
+        most_memory = self._memory[first]
+        for slot in range(first, first + count):
+            duration = self._durations[slot]
+            total += duration
+            if duration < shortest:
+                shortest = duration
+            if duration > longest:
+                longest = duration
+            if self._memory[slot] > most_memory:
+                most_memory = self._memory[slot]
+        return count, shortest, total // count, longest, most_memory
+
+    def add_fields(self, env_data):
+        """Adds the statistics of the stages that ran, and the free heap, to
+        one reading in window (the first, then every window-th), as they cover
+        the last window runs. Returns True if they were added."""
+        self._calls += 1
+        if (self._calls - 1) % self.window:
+            return False
+        for i, stage in enumerate(self.stages):
+            count, shortest, average, longest, most_memory = self.summary(stage)
+            if count:
+                names = self._names[i]
+                env_data[names[0]] = shortest
+                env_data[names[1]] = average
+                env_data[names[2]] = longest
+                env_data[names[3]] = most_memory
+        env_data["prof_mem_free"] = gc.mem_free()
+        return True
+
+    def print_report(self):
+        print(f"Stage statistics over the last {self.window} runs:")
+        for stage in self.stages:
+            count, shortest, average, longest, most_memory = self.summary(stage)
+            if count:
+                print(
+                    f"  {stage}: {shortest}/{average}/{longest} us "
+                    f"(min/avg/max), up to {most_memory} bytes, {count} runs"
+                )
+        print(f"  free heap: {gc.mem_free()} bytes")
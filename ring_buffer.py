@@ -0,0 +1,118 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Fixed-size ring buffer of binary records kept in a file on flash."""
+
+import struct
+
+# Magic, record size, capacity, index of the oldest record, number of records
+HEADER_FORMAT = "<4sHHHH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b"RBUF"
+
+
+class RingBuffer:
+    """Stores up to capacity records of record_size bytes in a file, so that
+    they survive reboots. When the buffer is full, the oldest record is
+    overwritten. Records are read oldest first with peek() and removed with
+    drop() once they have been handled.
+    """
+
+    def __init__(self, path, record_size, capacity):
+        self.record_size = record_size
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+        try:
+            self._file = open(path, "r+b")
+            header = self._file.read(HEADER_SIZE)
+        except OSError:
+            self._file = open(path, "w+b")
+            header = b""
+        if len(header) == HEADER_SIZE:
+            magic, size, capacity, head, count = struct.unpack(HEADER_FORMAT, header)
+            if (
+                magic == MAGIC
+                and size == self.record_size
+                and capacity == self.capacity
+                and head < capacity
+                and count <= capacity
+            ):
+                self.head = head
+                self.count = count
+                return
+        self._reset()
+
+    def __len__(self):
+        return self.count
+
+    def _reset(self):
+        # Write an empty header and allocate the space of all the records
+        self.head = 0
+        self.count = 0
+        self._file.seek(0)
+        self._save_header()
+        empty = bytes(self.record_size)
+        for i in range(self.capacity):
+            self._file.write(empty)
+        self._file.flush()
+
+    def _save_header(self):
+        self._file.seek(0)
+        self._file.write(
+            struct.pack(
+                HEADER_FORMAT,
+                MAGIC,
+                self.record_size,
+                self.capacity,
+                self.head,
+                self.count,
+            )
+        )
+
+    def _seek_record(self, index):
+        self._file.seek(HEADER_SIZE + (index % self.capacity) * self.record_size)
+
+    def append(self, record):
+        """Adds a record, overwriting the oldest one if the buffer is full."""
+        self._seek_record(self.head + self.count)
+        self._file.write(record)
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.head = (self.head + 1) % self.capacity
+        self._save_header()
+        self._file.flush()
+
+    def peek(self, n):
+        """Returns a list of the n oldest records (or fewer if there are not
+        as many), without removing them."""
+        records = []
+        for i in range(min(n, self.count)):
+            self._seek_record(self.head + i)
+            records.append(self._file.read(self.record_size))
+        return records
+
+    def drop(self, n):
+        """Removes the n oldest records."""
+        n = min(n, self.count)
+        self.head = (self.head + n) % self.capacity
+        self.count -= n
+        self._save_header()
+        self._file.flush()
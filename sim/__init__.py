@@ -0,0 +1,173 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Simulator running the controller software on a computer, with CPython.
+
+install() replaces the MicroPython modules (machine, network, dht, onewire,
+ds18x20, ntptime, uasyncio, ubinascii, deflate and utime) by models of the
+ESP8266 and of the devices connected to it, adds the MicroPython functions
+missing from the time and gc modules and loads the configuration from
+config.py.example. The software then runs as on the microcontroller:
+
+    python -m sim          # runs main.py, see sim/__main__.py
+    python -m sim.bench    # measures each stage of a reading cycle
+"""
+
+import calendar
+import gc
+import importlib
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+from sim import clock, devices
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = (
+    "machine",
+    "network",
+    "dht",
+    "onewire",
+    "ds18x20",
+    "ntptime",
+    "uasyncio",
+    "ubinascii",
+    "deflate",
+)
+
+# About the free heap of the ESP8266 port after boot. The simulated heap is
+# only used by the allocations made since trace_allocations(), as measured by
+# tracemalloc, so it runs out faster than on MicroPython, whose objects are
+# smaller.
+HEAP_SIZE = 38 * 1024
+
+environment = None  # conditions measured by the sensors, set by install()
+
+_gmtime = time.gmtime
+_heap_base = 0
+_gc_threshold = -1
+
+
+def install(speed=1.0, probes=2, **settings):
+    """Installs the models, with probes DS18B20 probes on the 1-wire bus, and
+    returns the configuration, whose values are overridden by settings.
+    The simulated time runs speed times faster than the real time."""
+    global environment
+    clock.speed = speed
+    _patch_time()
+    _patch_gc()
+    for name in MODULES:
+        sys.modules[name] = importlib.import_module("sim." + name)
+    sys.modules["utime"] = time
+    config = load_config(settings)
+    sys.modules["config"] = config
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    environment = devices.Environment()
+    from sim import dht, machine, network, onewire
+
+    dht.environment = environment
+    machine.i2c_devices.clear()
+    if config.BME280:
+        machine.i2c_devices[int(config.BME280_ADDRESS)] = devices.BME280(environment)
+    if config.LCD:
+        machine.i2c_devices[int(config.LCD_ADDRESS)] = devices.Lcd(
+            config.LCD_TOTALROWS, config.LCD_TOTALCOLUMNS
+        )
+    onewire.buses[config.ONEWIRE_PIN] = [
+        devices.DS18B20(environment, serial, offset=-0.5 * (serial - 1))
+        for serial in range(1, probes + 1)
+    ]
+    network.access_points[:] = [
+        (config.WIFI_SSID.encode(), b"\x5c\xcf\x7f\x00\x00\x01", 6, -72, 3, False),
+        (config.WIFI_SSID.encode(), b"\x5c\xcf\x7f\x00\x00\x02", 11, -61, 3, False),
+    ]
+    network.password = config.WIFI_PASSWORD
+    return config
+
+
+def load_config(settings):
+    """Returns the configuration of config.py.example, with the values of
+    settings."""
+    config = types.ModuleType("config")
+    path = os.path.join(ROOT, "config.py.example")
+    with open(path) as f:
+        exec(compile(f.read(), path, "exec"), config.__dict__)
+    for name in settings:
+        if not hasattr(config, name):
+            raise AttributeError(f"Unknown setting {name}")
+        setattr(config, name, settings[name])
+    return config
+
+
+def trace_allocations():
+    """Starts measuring the allocations, the simulated heap being empty."""
+    global _heap_base
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _heap_base = tracemalloc.get_traced_memory()[0]
+
+
+def _localtime(secs=None):
+    # MicroPython counts the seconds from 2000-01-01
+    if secs is None:
+        secs = clock.rtc_time()
+    return tuple(_gmtime(int(secs) + clock.EPOCH_2000))[:8]
+
+
+def _mktime(t):
+    return calendar.timegm(tuple(t[:6]) + (0, 0, 0)) - clock.EPOCH_2000
+
+
+def _patch_time():
+    time.ticks_ms = lambda: clock.ticks_us() // 1000
+    time.ticks_us = clock.ticks_us
+    time.ticks_cpu = clock.ticks_us
+    time.ticks_diff = lambda end, start: end - start
+    time.ticks_add = lambda ticks, delta: ticks + delta
+    time.sleep = clock.sleep
+    time.sleep_ms = lambda ms: clock.sleep(ms / 1000)
+    time.sleep_us = lambda us: clock.sleep(us / 1000000)
+    time.time = lambda: int(clock.rtc_time())
+    time.localtime = _localtime
+    time.gmtime = _localtime
+    time.mktime = _mktime
+
+
+def _mem_alloc():
+    if not tracemalloc.is_tracing():
+        return 0
+    return max(0, tracemalloc.get_traced_memory()[0] - _heap_base)
+
+
+def _threshold(amount=None):
+    global _gc_threshold
+    if amount is None:
+        return _gc_threshold
+    _gc_threshold = amount
+
+
+def _patch_gc():
+    gc.mem_alloc = _mem_alloc
+    gc.mem_free = lambda: max(0, HEAP_SIZE - _mem_alloc())
+    gc.threshold = _threshold
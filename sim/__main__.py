@@ -0,0 +1,109 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Runs main.py in the simulator:
+
+    python -m sim [--speed 60] [--duration 3600] [--flash DIR] [SETTING=VALUE ...]
+
+The settings override those of config.py.example, e.g. CONNECT_WIFI=True
+SEND_DATA_INFLUXDB=True to send the readings to a local server. The files
+written by the software are kept in the flash directory, a temporary one by
+default. After a deep sleep, main.py is run again, as on a wake-up."""
+
+import argparse
+import ast
+import os
+import runpy
+import tempfile
+
+import sim
+from sim import clock
+
+
+def parse_settings(parser, items):
+    settings = {}
+    for item in items:
+        name, separator, value = item.partition("=")
+        if not separator:
+            parser.error(f"Expected SETTING=VALUE, not {item}")
+        try:
+            settings[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            settings[name] = value  # a string without quotes
+    return settings
+
+
+def report(boots):
+    from sim import machine, ntptime
+
+    print(f"--- {clock.seconds():.0f} simulated seconds, {boots} boot(s)")
+    # One bus is created at each boot
+    print(
+        "I2C: {} transactions, {} bytes, {:.1f} ms".format(
+            sum(bus.transactions for bus in machine.buses),
+            sum(bus.bytes for bus in machine.buses),
+            sum(bus.bus_us for bus in machine.buses) / 1000,
+        )
+    )
+    print(f"Clock set {ntptime.syncs} time(s) by NTP")
+    for device in machine.i2c_devices.values():
+        if hasattr(device, "text"):
+            print("LCD:")
+            for line in device.text():
+                print(f"|{line}|")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m sim", description="Runs main.py in the simulator."
+    )
+    parser.add_argument(
+        "--speed", type=float, default=60.0, help="times faster than real time"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=3600.0, help="simulated seconds to run"
+    )
+    parser.add_argument("--flash", help="directory of the flash file system")
+    parser.add_argument("settings", nargs="*", metavar="SETTING=VALUE")
+    args = parser.parse_args()
+
+    sim.install(args.speed, **parse_settings(parser, args.settings))
+    from sim import machine
+
+    flash = args.flash or tempfile.mkdtemp(prefix="sim-flash-")
+    print(f"Flash file system in {flash}")
+    os.chdir(flash)
+    clock.stop_at = clock.seconds() + args.duration
+    boots = 0
+    while True:
+        boots += 1
+        try:
+            runpy.run_path(os.path.join(sim.ROOT, "main.py"), run_name="__main__")
+            break
+        except machine.DeepSleep as sleep:
+            machine.wake(sleep.time_ms)
+            if clock.seconds() >= clock.stop_at:
+                break
+        except (clock.Stopped, KeyboardInterrupt):
+            break
+    report(boots)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Measures the work of each stage of a reading cycle of main.py:
+
+    python -m sim.bench [--cycles 20] [SETTING=VALUE ...]
+
+The stages are run one after the other, as in main.run but without waiting
+between them: reading the sensors, controlling the pump, refreshing the
+display and encoding the readings for the servers, once per batch of
+UPLINK_BATCH_SIZE readings. For each stage, the average per cycle is shown
+of the I2C transactions, of the bytes on the bus, of the time they take and
+of the memory allocated. The memory is measured with tracemalloc: the sizes
+are those of CPython objects, larger than on MicroPython, but they show which
+stages allocate."""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import tempfile
+import tracemalloc
+
+import sim
+from sim import clock
+from sim.__main__ import parse_settings
+
+STAGES = ("sensors", "control", "display", "encoding")
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_us = 0.0
+        self.allocated = 0  # peak of the memory allocated during the stage
+        self.kept = 0  # memory still allocated at the end of the stage
+
+    async def measure(self, i2c, function, *args):
+        transactions, size, bus_us = i2c.transactions, i2c.bytes, i2c.bus_us
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = function(*args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        current, peak = tracemalloc.get_traced_memory()
+        self.transactions += i2c.transactions - transactions
+        self.bytes += i2c.bytes - size
+        self.bus_us += i2c.bus_us - bus_us
+        self.allocated += peak - before
+        self.kept += current - before
+        return result
+
+
+async def run_cycles(main, config, cycles, warmup):
+    hardware = main.initialize()
+    is_connected = False
+    uplinks = main.create_uplinks()
+    stages = {name: Stage(name) for name in STAGES}
+    state = {"start_vacuum_pump": False, "batch": []}
+    sim.trace_allocations()
+    for cycle in range(warmup + cycles):
+        if cycle == warmup:
+            stages = {name: Stage(name) for name in STAGES}
+        await _cycle(main, config, hardware, is_connected, uplinks, stages, state)
+        clock.skip(config.DELAY_READING * 1000000)
+    return stages
+
+
+async def _cycle(main, config, hardware, is_connected, uplinks, stages, state):
+    i2c = hardware.i2c
+    env_data = await stages["sensors"].measure(i2c, main.get_env_data, hardware)
+    state["start_vacuum_pump"] = await stages["control"].measure(
+        i2c, main.control_vacuum_pump, hardware, env_data, state["start_vacuum_pump"]
+    )
+    env_data["pump"] = state["start_vacuum_pump"]
+    if hardware.lcd is not None:
+        await stages["display"].measure(
+            i2c,
+            main.display_data,
+            is_connected,
+            env_data,
+            state["start_vacuum_pump"],
+            hardware.lcd,
+        )
+    batch = state["batch"]
+    batch.append(env_data)
+    if len(batch) >= config.UPLINK_BATCH_SIZE:
+        for client, encoder in uplinks.values():
+            await stages["encoding"].measure(i2c, encoder.encode, batch)
+        batch.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m sim.bench",
+        description="Measures the work of each stage of a reading cycle of main.py.",
+    )
+    parser.add_argument("--cycles", type=int, default=20, help="cycles measured")
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="cycles run before measuring"
+    )
+    parser.add_argument("settings", nargs="*", metavar="SETTING=VALUE")
+    args = parser.parse_args()
+
+    # The readings are encoded for both servers, but never sent
+    settings = {"SEND_DATA_HTTP": True, "SEND_DATA_INFLUXDB": True}
+    settings.update(parse_settings(parser, args.settings))
+    config = sim.install(speed=1000.0, **settings)
+    os.chdir(tempfile.mkdtemp(prefix="sim-flash-"))
+
+    # The messages of main.py are dropped, without keeping them in memory
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import main as controller
+
+        stages = asyncio.run(
+            run_cycles(controller, config, args.cycles, args.warmup)
+        )
+
+    print(f"Average per cycle over {args.cycles} cycles:")
+    print(
+        "{:<10} {:>8} {:>8} {:>9} {:>10} {:>8}".format(
+            "stage", "I2C txn", "bytes", "bus ms", "alloc B", "kept B"
+        )
+    )
+    total = Stage("total")
+    for stage in list(stages.values()) + [total]:
+        if stage is not total:
+            for name in ("transactions", "bytes", "bus_us", "allocated", "kept"):
+                setattr(total, name, getattr(total, name) + getattr(stage, name))
+        print(
+            "{:<10} {:>8.1f} {:>8.1f} {:>9.2f} {:>10.0f} {:>8.0f}".format(
+                stage.name,
+                stage.transactions / args.cycles,
+                stage.bytes / args.cycles,
+                stage.bus_us / 1000 / args.cycles,
+                stage.allocated / args.cycles,
+                stage.kept / args.cycles,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Simulated time, running speed times faster than the real time.
+
+The ticks restart from 0 at each boot, like on the microcontroller, and the
+clock of the RTC starts in 2000, until it is set by ntptime."""
+
+import time as _time
+
+# Offset between the Unix epoch and the MicroPython epoch (2000-01-01)
+EPOCH_2000 = 946684800
+
+_monotonic = _time.monotonic
+_sleep = _time.sleep
+_wall_start = _time.time()
+
+speed = 1.0
+stop_at = None  # simulated time at which the simulation stops, in seconds
+
+_start = _monotonic()
+_skipped_us = 0  # time spent in deep sleep, not waited for
+_boot_us = 0
+_rtc_base = 0  # RTC time (MicroPython epoch) at simulated time 0
+
+
+class Stopped(Exception):
+    """Raised when the simulated time reaches stop_at."""
+
+
+def now_us():
+    """Simulated time since the start of the simulation, in µs."""
+    return int((_monotonic() - _start) * speed * 1000000) + _skipped_us
+
+
+def seconds():
+    return now_us() / 1000000
+
+
+def boot():
+    """Restarts the ticks from 0, as after a reset."""
+    global _boot_us
+    _boot_us = now_us()
+
+
+def ticks_us():
+    return now_us() - _boot_us
+
+
+def sleep(seconds):
+    """Blocks for seconds of simulated time."""
+    if seconds > 0:
+        _sleep(seconds / speed)
+
+
+def skip(us):
+    """Moves the simulated time forward without waiting, e.g. during a deep
+    sleep."""
+    global _skipped_us
+    _skipped_us += us
+
+
+def wall_time():
+    """Real time of the simulation, in seconds since the Unix epoch."""
+    return _wall_start + seconds()
+
+
+def rtc_time():
+    """Time of the RTC, in seconds since 2000-01-01."""
+    return _rtc_base + seconds()
+
+
+def set_rtc(timestamp):
+    """Sets the RTC (in seconds since 2000-01-01)."""
+    global _rtc_base
+    _rtc_base = timestamp - seconds()
+
+
+def check_stop():
+    if stop_at is not None and seconds() >= stop_at:
+        raise Stopped()
@@ -0,0 +1,53 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""deflate module of MicroPython 1.21+, compressing with zlib."""
+
+import zlib
+
+AUTO = 0
+RAW = 1
+ZLIB = 2
+GZIP = 3
+
+_WBITS = {RAW: -15, ZLIB: 15, GZIP: 31}
+
+
+class DeflateIO:
+    def __init__(self, stream, format=AUTO, wbits=0, close=False):
+        self.stream = stream
+        self.close_stream = close
+        self._compressor = zlib.compressobj(wbits=_WBITS.get(format, 15))
+
+    def write(self, data):
+        self.stream.write(self._compressor.compress(bytes(data)))
+        return len(data)
+
+    def close(self):
+        if self._compressor is not None:
+            self.stream.write(self._compressor.flush())
+            self._compressor = None
+            if self.close_stream:
+                self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
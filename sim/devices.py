@@ -0,0 +1,355 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Models of the sensors and of the LCD, as seen from their bus, and of the
+environment they measure."""
+
+import math
+import random
+import struct
+
+from sim import clock
+
+
+class Environment:
+    """Conditions in the sugar bush. The temperature follows a daily cycle
+    around temperature (°C), swinging by swing degrees, with some noise on
+    every value."""
+
+    def __init__(
+        self, temperature=0.0, swing=5.0, humidity=80.0, pressure=101000.0, noise=0.1
+    ):
+        self.mean_temperature = temperature
+        self.swing = swing
+        self.mean_humidity = humidity
+        self.mean_pressure = pressure  # Pa
+        self.noise = noise
+        self.random = random.Random(0)
+
+    def _noise(self):
+        return self.random.uniform(-self.noise, self.noise)
+
+    def temperature(self):
+        # Coldest at midnight, warmest at noon
+        day = (clock.wall_time() % 86400) / 86400
+        cycle = -math.cos(2 * math.pi * day)
+        return self.mean_temperature + self.swing * cycle + self._noise()
+
+    def humidity(self):
+        return min(100.0, max(0.0, self.mean_humidity + 10 * self._noise()))
+
+    def pressure(self):
+        return self.mean_pressure + 100 * self._noise()
+
+
+class I2cDevice:
+    """Device on the I2C bus: write() receives the bytes of a write
+    transaction, read() returns those of a read transaction."""
+
+    def write(self, data):
+        raise OSError(5)  # EIO
+
+    def read(self, size):
+        raise OSError(5)
+
+
+class BME280(I2cDevice):
+    """BME280 register map: calibration data, forced and normal modes, status
+    register and data registers. The raw readings are computed from the
+    environment by inverting the compensation formulas of the datasheet."""
+
+    # Calibration data of the example of the datasheet
+    T = (27504, 26435, -1000)
+    P = (36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000)
+    H = (75, 362, 0, 309, 50, 30)
+
+    def __init__(self, environment):
+        self.environment = environment
+        self.registers = bytearray(256)
+        self.pointer = 0
+        self.measuring_until = 0
+        self.conversions = 0
+        self.registers[0xD0] = 0x60  # chip ID
+        self.registers[0x88:0xA0] = struct.pack("<HhhHhhhhhhhh", *(self.T + self.P))
+        self.registers[0xA1] = self.H[0]
+        h4, h5 = self.H[3], self.H[4]
+        self.registers[0xE1:0xE8] = struct.pack(
+            "<hBBBBb",
+            self.H[1],
+            self.H[2],
+            h4 >> 4,
+            (h5 & 0x0F) << 4 | h4 & 0x0F,
+            h5 >> 4,
+            self.H[5],
+        )
+        self._sample()
+
+    def write(self, data):
+        self.pointer = data[0]
+        for value in data[1:]:
+            self.registers[self.pointer] = value
+            if self.pointer == 0xF4 and value & 0x03 == 0x01:
+                # Forced mode: one conversion, then back to sleep
+                self.measuring_until = clock.now_us() + self._measurement_us()
+            self.pointer = (self.pointer + 1) & 0xFF
+
+    def read(self, size):
+        self._update()
+        data = bytes(
+            self.registers[(self.pointer + i) & 0xFF] for i in range(size)
+        )
+        self.pointer = (self.pointer + size) & 0xFF
+        return data
+
+    def _oversampling(self):
+        ctrl_meas = self.registers[0xF4]
+        return ctrl_meas >> 5, ctrl_meas >> 2 & 0x07, self.registers[0xF2] & 0x07
+
+    def _measurement_us(self):
+        # Maximum measurement time of the datasheet (appendix B)
+        osrs_t, osrs_p, osrs_h = (
+            (1 << code >> 1) if code else 0 for code in self._oversampling()
+        )
+        time_ms = 1.25 + 2.3 * osrs_t
+        if osrs_p:
+            time_ms += 2.3 * osrs_p + 0.575
+        if osrs_h:
+            time_ms += 2.3 * osrs_h + 0.575
+        return int(time_ms * 1000)
+
+    def _update(self):
+        mode = self.registers[0xF4] & 0x03
+        if self.measuring_until:
+            if clock.now_us() < self.measuring_until:
+                self.registers[0xF3] = 0x08  # measuring
+                return
+            self.measuring_until = 0
+            self.registers[0xF4] &= 0xFC  # back to sleep mode
+            self._sample()
+        elif mode == 0x03:
+            self._sample()  # normal mode: always a recent conversion
+        self.registers[0xF3] = 0
+
+    def _sample(self):
+        self.conversions += 1
+        osrs_t, osrs_p, osrs_h = self._oversampling()
+        adc_t = self._raw_temperature(self.environment.temperature())
+        t_fine = self._compensate_temperature(adc_t)[1]
+        adc_p = self._raw_pressure(self.environment.pressure(), t_fine)
+        adc_h = self._raw_humidity(self.environment.humidity(), t_fine)
+        # Skipped measurements read as 0x80000 (0x8000 for the humidity)
+        data = struct.pack(
+            ">IIH",
+            (adc_p if osrs_p else 0x80000) << 12,
+            (adc_t if osrs_t else 0x80000) << 12,
+            adc_h if osrs_h else 0x8000,
+        )
+        self.registers[0xF7:0xFF] = data[0:3] + data[4:7] + data[8:10]
+
+    def _compensate_temperature(self, adc_t):
+        t1, t2, t3 = self.T
+        var1 = (adc_t / 16384 - t1 / 1024) * t2
+        var2 = (adc_t / 131072 - t1 / 8192) ** 2 * t3
+        t_fine = var1 + var2
+        return t_fine / 5120, t_fine
+
+    def _compensate_pressure(self, adc_p, t_fine):
+        p1, p2, p3, p4, p5, p6, p7, p8, p9 = self.P
+        var1 = t_fine / 2 - 64000
+        var2 = var1 * var1 * p6 / 32768 + var1 * p5 * 2
+        var2 = var2 / 4 + p4 * 65536
+        var1 = (p3 * var1 * var1 / 524288 + p2 * var1) / 524288
+        var1 = (1 + var1 / 32768) * p1
+        pressure = (1048576 - adc_p - var2 / 4096) * 6250 / var1
+        var1 = p9 * pressure * pressure / 2147483648
+        var2 = pressure * p8 / 32768
+        return pressure + (var1 + var2 + p7) / 16
+
+    def _compensate_humidity(self, adc_h, t_fine):
+        h1, h2, h3, h4, h5, h6 = self.H
+        var = t_fine - 76800
+        var = (adc_h - (h4 * 64 + h5 / 16384 * var)) * (
+            h2 / 65536 * (1 + h6 / 67108864 * var * (1 + h3 / 67108864 * var))
+        )
+        return var * (1 - h1 * var / 524288)
+
+    @staticmethod
+    def _invert(function, target, bits, increasing=True):
+        # Smallest raw value whose compensated value reaches target
+        low, high = 0, (1 << bits) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if (function(middle) < target) == increasing:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _raw_temperature(self, temperature):
+        return self._invert(
+            lambda adc: self._compensate_temperature(adc)[0], temperature, 20
+        )
+
+    def _raw_pressure(self, pressure, t_fine):
+        return self._invert(
+            lambda adc: self._compensate_pressure(adc, t_fine), pressure, 20, False
+        )
+
+    def _raw_humidity(self, humidity, t_fine):
+        return self._invert(
+            lambda adc: self._compensate_humidity(adc, t_fine), humidity, 16
+        )
+
+
+class Lcd(I2cDevice):
+    """HD44780 character LCD behind a PCF8574 I2C expander. The writes to the
+    expander are decoded (P0=RS, P2=E, P3=backlight, P4-P7=D4-D7) and the
+    nibbles latched on the falling edges of E are executed as commands or
+    written to the display RAM."""
+
+    def __init__(self, lines, columns):
+        self.lines = lines
+        self.columns = columns
+        self.ddram = bytearray(b" " * 128)
+        self.address = 0
+        self.port = 0
+        self.four_bits = False
+        self.high_nibble = None
+        self.backlight = False
+        self.commands = 0
+        self.characters = 0
+
+    def write(self, data):
+        for port in data:
+            if self.port & 0x04 and not port & 0x04:
+                self._latch(self.port & 0x01, self.port >> 4)
+            self.port = port
+            self.backlight = bool(port & 0x08)
+
+    def read(self, size):
+        return bytes([self.port]) * size
+
+    def _latch(self, rs, nibble):
+        if not self.four_bits:
+            # 8-bit mode, only D4-D7 are wired: function set commands
+            if nibble == 0x02:
+                self.four_bits = True
+            return
+        if self.high_nibble is None:
+            self.high_nibble = nibble
+            return
+        value = self.high_nibble << 4 | nibble
+        self.high_nibble = None
+        if rs:
+            self._write_data(value)
+        else:
+            self._execute(value)
+
+    def _write_data(self, value):
+        self.characters += 1
+        self.ddram[self.address] = value
+        # In 2-line mode, the display RAM is 0x00-0x27 then 0x40-0x67
+        self.address += 1
+        if self.address == 0x28:
+            self.address = 0x40
+        elif self.address == 0x68:
+            self.address = 0
+
+    def _execute(self, command):
+        self.commands += 1
+        if command == 0x01:  # clear
+            self.ddram[:] = b" " * 128
+            self.address = 0
+        elif command & 0xFE == 0x02:  # return home
+            self.address = 0
+        elif command & 0x80:  # set the display RAM address
+            self.address = command & 0x7F
+
+    def text(self):
+        """Returns the lines shown on the display."""
+        offsets = (0x00, 0x40, self.columns, 0x40 + self.columns)
+        return [
+            bytes(self.ddram[offset : offset + self.columns]).decode("latin-1")
+            for offset in offsets[: self.lines]
+        ]
+
+
+class DS18B20:
+    """DS18B20 1-wire temperature probe, offset degrees away from the
+    temperature of the environment. A conversion takes from 94 ms (9 bits) to
+    750 ms (12 bits): reading earlier returns the previous temperature, or
+    85 °C after power-on."""
+
+    def __init__(self, environment, serial, offset=0.0):
+        self.environment = environment
+        self.offset = offset
+        rom = bytearray(b"\x28" + serial.to_bytes(6, "little") + b"\x00")
+        rom[7] = crc8(rom[:7])
+        self.rom = bytes(rom)
+        self.alarm_high = 75
+        self.alarm_low = 70
+        self.configuration = 0x7F  # 12 bits
+        self.temperature = 85.0
+        self.converting_until = None
+        self.conversions = 0
+
+    def resolution(self):
+        return 9 + (self.configuration >> 5 & 0x03)
+
+    def convert(self):
+        self.conversions += 1
+        self._update()
+        self.converting_until = clock.now_us() + (750000 >> 12 - self.resolution())
+        step = 1 / (1 << self.resolution() - 8)
+        self._next_temperature = (
+            round((self.environment.temperature() + self.offset) / step) * step
+        )
+
+    def _update(self):
+        if self.converting_until and clock.now_us() >= self.converting_until:
+            self.temperature = self._next_temperature
+            self.converting_until = None
+
+    def scratchpad(self):
+        self._update()
+        raw = round(self.temperature * 16)
+        data = bytearray(
+            struct.pack(
+                "<hbbB", raw, self.alarm_high, self.alarm_low, self.configuration
+            )
+            + b"\xff\x0c\x10"
+        )
+        return data + bytes([crc8(data)])
+
+    def write_scratchpad(self, data):
+        self.alarm_high, self.alarm_low = struct.unpack("<bb", data[:2])
+        self.configuration = data[2] & 0x60 | 0x1F
+
+
+def crc8(data):
+    """Dallas/Maxim CRC-8 of the 1-wire ROM codes and scratchpads."""
+    crc = 0
+    for byte in data:
+        for i in range(8):
+            mix = (crc ^ byte) & 0x01
+            crc >>= 1
+            if mix:
+                crc ^= 0x8C
+            byte >>= 1
+    return crc
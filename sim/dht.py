@@ -0,0 +1,51 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""DHT11 and DHT22 sensors, measuring the simulated environment."""
+
+environment = None  # set by sim.install()
+
+
+class DHTBase:
+    def __init__(self, pin):
+        self.pin = pin
+        self.measurements = 0
+        self._temperature = None
+        self._humidity = None
+
+    def measure(self):
+        self.measurements += 1
+        self._temperature = environment.temperature()
+        self._humidity = environment.humidity()
+
+
+class DHT11(DHTBase):
+    def temperature(self):
+        return round(self._temperature)
+
+    def humidity(self):
+        return round(self._humidity)
+
+
+class DHT22(DHTBase):
+    def temperature(self):
+        return round(self._temperature, 1)
+
+    def humidity(self):
+        return round(self._humidity, 1)
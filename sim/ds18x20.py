@@ -0,0 +1,53 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""DS18X20 driver, talking to the models of the probes instead of the bus."""
+
+from sim.onewire import crc8
+
+
+class DS18X20:
+    def __init__(self, onewire):
+        self.ow = onewire
+
+    def scan(self):
+        return [rom for rom in self.ow.scan() if rom[0] in (0x10, 0x22, 0x28)]
+
+    def convert_temp(self):
+        self.ow.reset(True)
+        for device in self.ow.devices:
+            device.convert()
+
+    def read_scratch(self, rom):
+        self.ow.reset(True)
+        scratch = self.ow.device(rom).scratchpad()
+        if crc8(scratch):
+            raise Exception("CRC error")
+        return scratch
+
+    def write_scratch(self, rom, buf):
+        self.ow.reset(True)
+        self.ow.device(rom).write_scratchpad(buf)
+
+    def read_temp(self, rom):
+        buf = self.read_scratch(rom)
+        t = buf[1] << 8 | buf[0]
+        if t & 0x8000:  # sign bit set
+            t = -((t ^ 0xFFFF) + 1)
+        return t / 16
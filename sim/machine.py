@@ -0,0 +1,175 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""machine module of the ESP8266 port: pins, I2C bus with the models of the
+devices connected to it, RTC memory and deep sleep."""
+
+from sim import clock
+
+PWRON_RESET = 0
+WDT_RESET = 1
+SOFT_RESET = 4
+DEEPSLEEP_RESET = 5
+HARD_RESET = 6
+
+i2c_devices = {}  # models of the I2C devices, by address
+buses = []  # I2C buses created by the software
+pins = {}  # level of each pin, by number
+
+_reset_cause = PWRON_RESET
+_rtc_memory = b""
+
+
+class DeepSleep(Exception):
+    """Raised by deepsleep(), for the simulator to boot the software again
+    once the sleep time is over."""
+
+    def __init__(self, time_ms):
+        Exception.__init__(self, time_ms)
+        self.time_ms = time_ms
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        pins.setdefault(id, 0)
+        if value is not None:
+            pins[id] = int(bool(value))
+
+    def value(self, value=None):
+        if value is None:
+            return pins[self.id]
+        pins[self.id] = int(bool(value))
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        pins[self.id] = 1
+
+    def off(self):
+        pins[self.id] = 0
+
+
+class I2C:
+    """I2C bus counting its transactions, the bytes sent on the wire (device
+    addresses included) and the time they take at freq Hz. Like on the
+    ESP8266, whose I2C is bit-banged, a transfer blocks for that time."""
+
+    def __init__(self, id=-1, *, scl=None, sda=None, freq=400000, timeout=255):
+        self.freq = freq
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_us = 0.0
+        buses.append(self)
+
+    def _device(self, addr):
+        device = i2c_devices.get(addr)
+        if device is None:
+            raise OSError(19)  # ENODEV
+        return device
+
+    def _transfer(self, size, restarts=0):
+        # 9 clock cycles per byte (8 bits and the ACK), plus the start and
+        # stop conditions
+        self.transactions += 1
+        self.bytes += size
+        bus_us = (9 * size + 2 + restarts) * 1000000 / self.freq
+        self.bus_us += bus_us
+        clock.sleep(bus_us / 1000000)
+
+    def scan(self):
+        return sorted(i2c_devices)
+
+    def writeto(self, addr, buf, stop=True):
+        device = self._device(addr)
+        self._transfer(1 + len(buf))
+        device.write(bytes(buf))
+        return len(buf)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        device = self._device(addr)
+        self._transfer(1 + nbytes)
+        return device.read(nbytes)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        buf[:] = self.readfrom(addr, len(buf))
+
+    def writeto_mem(self, addr, memaddr, buf, *, addrsize=8):
+        device = self._device(addr)
+        self._transfer(2 + len(buf))
+        device.write(bytes([memaddr]) + bytes(buf))
+
+    def readfrom_mem(self, addr, memaddr, nbytes, *, addrsize=8):
+        device = self._device(addr)
+        self._transfer(3 + nbytes, restarts=1)
+        device.write(bytes([memaddr]))
+        return device.read(nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, *, addrsize=8):
+        buf[:] = self.readfrom_mem(addr, memaddr, len(buf))
+
+
+class RTC:
+    def memory(self, data=None):
+        global _rtc_memory
+        if data is None:
+            return _rtc_memory
+        if len(data) > 492:
+            raise ValueError("buffer too long")
+        _rtc_memory = bytes(data)
+
+    def datetime(self, datetimetuple=None):
+        import time
+
+        if datetimetuple is not None:
+            raise NotImplementedError("use ntptime to set the simulated clock")
+        year, month, day, hour, minute, second, weekday, yearday = time.localtime()
+        return (year, month, day, weekday, hour, minute, second, 0)
+
+
+def reset_cause():
+    return _reset_cause
+
+
+def deepsleep(time_ms=0):
+    raise DeepSleep(time_ms)
+
+
+def wake(time_ms):
+    """Ends a deep sleep of time_ms: the RTC memory is kept, the ticks
+    restart and the pins are released."""
+    global _reset_cause
+    clock.skip(time_ms * 1000)
+    clock.boot()
+    pins.clear()
+    _reset_cause = DEEPSLEEP_RESET
+
+
+def freq(hz=None):
+    return 80000000
+
+
+def unique_id():
+    return b"\x53\x49\x4d"
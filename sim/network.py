@@ -0,0 +1,120 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""network module: Wi-Fi interfaces connecting to simulated access points.
+
+Connecting takes CONNECT_MS, or SCAN_MS more when the access point is not
+given by its BSSID, and a scan blocks for SCAN_MS. Setting outage to True
+drops the connection until it is set back to False."""
+
+from sim import clock
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = 2
+STAT_NO_AP_FOUND = 3
+STAT_GOT_IP = 5
+
+CONNECT_MS = 1000
+SCAN_MS = 2000
+
+# SSID, BSSID, channel, RSSI, authentication mode and hidden, as from scan()
+access_points = []
+password = None  # of the access points, None to accept any
+outage = False
+
+_interfaces = {}
+
+
+class _Interface:
+    def __init__(self):
+        self.active = False
+        self.ssid = None
+        self.connected_at = None  # simulated time at which it connects, in µs
+        self.config = {"mac": b"\x5c\xcf\x7f\x53\x49\x4d", "essid": ""}
+
+
+def _find(ssid, bssid):
+    for access_point in access_points:
+        if access_point[0].decode() == ssid and (
+            bssid is None or access_point[1] == bssid
+        ):
+            return access_point
+    return None
+
+
+class WLAN:
+    def __init__(self, interface_id=STA_IF):
+        self.interface_id = interface_id
+        self._interface = _interfaces.setdefault(interface_id, _Interface())
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._interface.active
+        self._interface.active = bool(is_active)
+        if not is_active:
+            self._interface.connected_at = None
+
+    def connect(self, ssid=None, key=None, *, bssid=None):
+        interface = self._interface
+        interface.ssid = ssid
+        interface.connected_at = None
+        if _find(ssid, bssid) is not None and password in (None, key):
+            delay_ms = CONNECT_MS if bssid is not None else CONNECT_MS + SCAN_MS
+            interface.connected_at = clock.now_us() + delay_ms * 1000
+
+    def disconnect(self):
+        self._interface.connected_at = None
+
+    def isconnected(self):
+        interface = self._interface
+        if self.interface_id == AP_IF:
+            return interface.active
+        return (
+            interface.active
+            and not outage
+            and interface.connected_at is not None
+            and clock.now_us() >= interface.connected_at
+        )
+
+    def status(self, param=None):
+        if param == "rssi":
+            return access_points[0][3] if access_points else -100
+        if self.isconnected():
+            return STAT_GOT_IP
+        if self._interface.connected_at is not None:
+            return STAT_CONNECTING
+        return STAT_IDLE
+
+    def scan(self):
+        clock.sleep(SCAN_MS / 1000)
+        return list(access_points)
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._interface.config[args[0]]
+        self._interface.config.update(kwargs)
+
+    def ifconfig(self, config=None):
+        if self.interface_id == AP_IF:
+            return ("192.168.4.1", "255.255.255.0", "192.168.4.1", "192.168.4.1")
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
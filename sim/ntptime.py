@@ -0,0 +1,32 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""ntptime, setting the RTC to the time of the computer."""
+
+from sim import clock
+
+host = "pool.ntp.org"
+timeout = 1
+syncs = 0  # number of calls to settime
+
+
+def settime():
+    global syncs
+    syncs += 1
+    clock.set_rtc(clock.wall_time() - clock.EPOCH_2000)
@@ -0,0 +1,49 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""1-wire bus, with the models of the probes connected to each pin."""
+
+from sim.devices import crc8
+
+buses = {}  # models of the 1-wire devices, by pin number
+
+
+class OneWireError(Exception):
+    pass
+
+
+class OneWire:
+    def __init__(self, pin):
+        self.devices = buses.get(pin.id, [])
+
+    def scan(self):
+        return [bytearray(device.rom) for device in self.devices]
+
+    def reset(self, required=False):
+        if required and not self.devices:
+            raise OneWireError
+        return bool(self.devices)
+
+    def device(self, rom):
+        """Model of the device with the given ROM code."""
+        for device in self.devices:
+            if device.rom == bytes(rom):
+                return device
+        raise OneWireError
+
@@ -0,0 +1,50 @@
+"""
+Maple Sap Vacuum Controller
+Software to control a maple sap vacuum system using an ESP8266 controller
+Copyright (C) 2022  Normand Cyr (norm@normandcyr.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""uasyncio on top of the asyncio module of CPython, with the sleeps in
+simulated time."""
+
+from asyncio import *
+import asyncio as _asyncio
+
+from sim import clock
+
+
+async def sleep(t):
+    await _asyncio.sleep(t / clock.speed)
+
+
+async def sleep_ms(t):
+    await _asyncio.sleep(t / 1000 / clock.speed)
+
+
+async def _until_stop(main):
+    if clock.stop_at is None:
+        return await main
+    try:
+        return await _asyncio.wait_for(
+            main, max(0, clock.stop_at - clock.seconds()) / clock.speed
+        )
+    except _asyncio.TimeoutError:
+        raise clock.Stopped() from None
+
+
+def run(main):
+    """Runs main until it returns, or until the simulation stops."""
+    return _asyncio.run(_until_stop(main))